@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+import csv_filter
+from csv_filter import CSVDataProcessor, EXPORT_FORMATS, expand_inputs, memory_bytes, write_export
+
+# Benchmark suite: seeded synthetic telecom CSVs timed through every stage of CSVDataProcessor
+#   python benchmark.py --rows 100000,1000000 --output results.json
+#   python benchmark.py --rows 100000 --output new.json --compare results.json
+
+PLANS = ["basic", "plus", "premium", "unlimited", "prepaid"]
+GENERATOR_CHUNK_ROWS = 100000
+
+def generate_telecom_csv(path, rows, extra_columns=0, regions=30, cells=5000, null_rate=0.0, seed=0):
+    #"""Write a reproducible telecom-style CSV (one row per subscriber session), returns its size in bytes"""
+    rng = np.random.default_rng(seed)
+    first = pd.Timestamp("2024-01-01")
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        for start in range(0, rows, GENERATOR_CHUNK_ROWS):
+            n = min(GENERATOR_CHUNK_ROWS, rows - start)
+            chunk = pd.DataFrame({
+                "msisdn": ["1" + str(number) for number in rng.integers(3000000000, 9999999999, n)],
+                "region": [f"R{index:03d}" for index in rng.integers(0, regions, n)],
+                "plan": np.array(PLANS, dtype=object)[rng.integers(0, len(PLANS), n)],
+                "cell_id": rng.integers(0, cells, n),
+                "call_date": (first + pd.to_timedelta(rng.integers(0, 366, n), unit='D')).strftime("%Y-%m-%d"),
+                "duration_sec": rng.exponential(180, n).astype(np.int64),
+                "data_mb": rng.lognormal(3, 1.2, n).round(3),
+                "fee": rng.gamma(2.0, 25.0, n).round(2),
+                "roaming": np.where(rng.random(n) < 0.05, "Y", "N")
+            })
+            for i in range(extra_columns):
+                chunk[f"metric_{i}"] = rng.normal(100, 15, n).round(4)
+            # Missing values in every column except the subscriber key
+            if null_rate > 0:
+                for col in chunk.columns[1:]:
+                    chunk[col] = chunk[col].where(rng.random(n) >= null_rate)
+            chunk.to_csv(out, index=False, header=start == 0)
+    return os.path.getsize(path)
+
+def filter_cases(cells):
+    #"""One filter rule per supported operator"""
+    return {
+        "eq": {"column": "region", "operator": "eq", "value": "R001"},
+        "ne": {"column": "plan", "operator": "ne", "value": "basic"},
+        "gt": {"column": "duration_sec", "operator": "gt", "value": "300"},
+        "ge": {"column": "fee", "operator": "ge", "value": "50"},
+        "lt": {"column": "data_mb", "operator": "lt", "value": "10"},
+        "le": {"column": "cell_id", "operator": "le", "value": str(cells // 2)},
+        "in": {"column": "region", "operator": "in", "value": "R000,R001,R002"},
+        "contains": {"column": "msisdn", "operator": "contains", "value": "88"},
+        "regex": {"column": "msisdn", "operator": "regex", "value": r"^1[3-5]\d*9$"},
+        "isnull": {"column": "fee", "operator": "isnull", "value": ""},
+        "notnull": {"column": "fee", "operator": "notnull", "value": ""}
+    }
+
+SORT_CASES = {
+    "1 key": [{"column": "fee", "ascending": False}],
+    "2 keys": [{"column": "region", "ascending": True}, {"column": "fee", "ascending": False}],
+    "3 keys": [{"column": "region", "ascending": True}, {"column": "plan", "ascending": True}, {"column": "duration_sec", "ascending": False}]
+}
+
+AGG_FUNCTIONS = ["sum", "mean", "count", "max", "min", "std"]
+
+def write_monthly_partitions(path, directory):
+    #"""Split a generated CSV into one CSV per call month, returns the partition paths"""
+    os.makedirs(directory, exist_ok=True)
+    df = pd.read_csv(path)
+    for month, part in df.groupby(df['call_date'].str[:7].fillna("none")):
+        part.to_csv(os.path.join(directory, f"{month}.csv"), index=False)
+    return expand_inputs([directory])
+
+def empty_config():
+    #"""Configuration without any rule, the whole frame passes through"""
+    return {"selected_columns": [], "filters": [], "sorting": [], "grouping": None, "aggregations": []}
+
+def peak_rss_mb():
+    #"""Peak resident memory of the process so far, None where the platform does not report it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def measure(run, repeat):
+    #"""Best wall time of repeated runs, then one traced run for the peak of Python / numpy allocations"""
+    seconds = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = run()
+        elapsed = time.perf_counter() - started
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    # Tracing slows allocations down, so it is kept out of the timed runs
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return seconds, peak, output
+
+class Benchmark:
+    def __init__(self, repeat=3, workdir=None):
+        self.repeat = repeat
+        self.workdir = workdir or tempfile.mkdtemp(prefix="csv_filter_bench_")
+        os.makedirs(self.workdir, exist_ok=True)
+        self.results = []
+
+    def record(self, stage, case, rows, size, run):
+        #"""Time one case and keep its throughput"""
+        seconds, peak, output = measure(run, self.repeat)
+        result = {
+            "stage": stage,
+            "case": case,
+            "rows": rows,
+            "bytes": size,
+            "seconds": seconds,
+            "rows_per_s": rows / seconds if seconds else None,
+            "mb_per_s": size / 1024 ** 2 / seconds if seconds else None,
+            "peak_mb": peak / 1024 ** 2,
+            # Arrow buffers are not traced, the process high-water mark covers them
+            "process_peak_rss_mb": peak_rss_mb(),
+            "output_rows": output
+        }
+        self.results.append(result)
+        print(f"{stage:<10} {case:<28} {rows:>10} rows {seconds:>9.4f}s {result['rows_per_s']:>14,.0f} rows/s "
+              f"{result['mb_per_s']:>9.1f} MB/s peak {result['peak_mb']:>9.1f} MB", flush=True)
+        return result
+
+    def load(self, path, optimize, backend="auto"):
+        #"""Load the file into a fresh processor"""
+        processor = CSVDataProcessor()
+        processor.optimize_dtypes = optimize
+        processor.parser_backend = backend
+        # Every timed run evaluates its stages, not the positions kept from the previous run
+        processor.reuse_stages = False
+        success, message = processor.load_csv(path)
+        if not success:
+            raise RuntimeError(message)
+        return processor
+
+    def process(self, processor, config):
+        #"""Run process_data with one configuration, returns the result row count"""
+        processor.config = dict(empty_config(), **config)
+        success, message = processor.process_data()
+        if not success:
+            raise RuntimeError(message)
+        return len(processor.processed_df)
+
+    def run_dataset(self, rows, extra_columns, regions, cells, null_rate, seed, optimize):
+        #"""Every stage over one generated dataset"""
+        path = os.path.join(self.workdir, f"telecom_{rows}_{extra_columns}_{regions}_{cells}_{null_rate}_{seed}.csv")
+        if not os.path.exists(path):
+            generate_telecom_csv(path, rows, extra_columns, regions, cells, null_rate, seed)
+        csv_bytes = os.path.getsize(path)
+
+        # 1. Load
+        self.record("load", "load_csv", rows, csv_bytes, lambda: len(self.load(path, False).df))
+        for backend in ["pandas"] + (["pyarrow"] if csv_filter.pa is not None else []):
+            self.record("load", f"load_csv {backend}", rows, csv_bytes, lambda: len(self.load(path, False, backend).df))
+        self.record("load", "load_csv optimized dtypes", rows, csv_bytes, lambda: len(self.load(path, True).df))
+        processor = self.load(path, optimize)
+        frame_bytes = memory_bytes(processor.df)
+
+        # 2. Filters, one per operator
+        for operator, rule in filter_cases(cells).items():
+            self.record("filter", operator, rows, frame_bytes, lambda: self.process(processor, {"filters": [rule]}))
+
+        # 3. Multi-key sorts
+        for name, sorting in SORT_CASES.items():
+            self.record("sort", name, rows, frame_bytes, lambda: self.process(processor, {"sorting": sorting}))
+
+        # 4. Group aggregation, every function and all of them at once
+        grouping = {"enabled": True, "columns": ["region"]}
+        for func in AGG_FUNCTIONS:
+            aggregations = [{"column": "data_mb", "function": func}]
+            self.record("groupby", func, rows, frame_bytes,
+                        lambda: self.process(processor, {"grouping": grouping, "aggregations": aggregations}))
+        aggregations = [{"column": "data_mb", "function": func} for func in AGG_FUNCTIONS]
+        self.record("groupby", "all functions, 2 keys", rows, frame_bytes,
+                    lambda: self.process(processor, {"grouping": {"enabled": True, "columns": ["region", "plan"]},
+                                                     "aggregations": aggregations}))
+
+        # 5. Exporters over the whole frame
+        self.process(processor, {})
+        self.record("export", "export_to_csv", rows, frame_bytes, lambda: len(processor.export_to_csv()))
+        self.record("export", "export_to_json", rows, frame_bytes, lambda: len(processor.export_to_json()))
+        output = os.path.join(self.workdir, "export")
+        for export_format in EXPORT_FORMATS:
+            if export_format == "Parquet" and csv_filter.pa is None:
+                continue
+            for compression in ("none", "gzip"):
+                self.record("export", f"write_export {export_format} {compression}", rows, frame_bytes,
+                            lambda: write_export(processor.processed_df, output, export_format, compression) and os.path.getsize(output))
+        os.remove(output)
+
+        # 6. Partitioned dataset: monthly files, a one-day query reads a single file through the zone maps
+        directory = os.path.splitext(path)[0] + "_monthly"
+        partitions = expand_inputs([directory]) if os.path.isdir(directory) else write_monthly_partitions(path, directory)
+        # The full scan reads the same files with pruning off, so the speedup is that of the zone maps alone
+        dataset = CSVDataProcessor()
+        full_scan = CSVDataProcessor()
+        full_scan.use_zone_maps = False
+        for partitioned in (dataset, full_scan):
+            success, message = partitioned.load_dataset(partitions)
+            if not success:
+                raise RuntimeError(message)
+        day = [{"column": "call_date", "operator": "eq", "value": "2024-06-15"}]
+        self.record("partition", "one day, zone maps", rows, csv_bytes, lambda: self.process(dataset, {"filters": day}))
+        self.record("partition", "one day, full scan", rows, csv_bytes, lambda: self.process(full_scan, {"filters": day}))
+
+def environment():
+    #"""Versions and machine of a run, so that results are only compared like for like"""
+    versions = {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__}
+    if csv_filter.pa is not None:
+        versions["pyarrow"] = csv_filter.pa.__version__
+    return {
+        "timestamp": datetime.now().isoformat(timespec='seconds'),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions
+    }
+
+def compare(results, baseline):
+    #"""Print the speed ratio of every case found in both runs, above 1 is faster than the baseline"""
+    previous = {(r['stage'], r['case'], r['rows']): r for r in baseline['results']}
+    for result in results:
+        old = previous.get((result['stage'], result['case'], result['rows']))
+        if old is None or not result['seconds']:
+            continue
+        speedup = old['seconds'] / result['seconds']
+        memory = result['peak_mb'] / old['peak_mb'] if old['peak_mb'] else float('nan')
+        print(f"{result['stage']:<10} {result['case']:<28} {result['rows']:>10} rows  speed x{speedup:5.2f}  peak memory x{memory:5.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark CSVDataProcessor on synthetic telecom CSVs")
+    parser.add_argument("--rows", default="100000", help="comma separated row counts")
+    parser.add_argument("--extra-columns", type=int, default=0, help="additional numeric columns (width)")
+    parser.add_argument("--regions", type=int, default=30, help="distinct region values (cardinality)")
+    parser.add_argument("--cells", type=int, default=5000, help="distinct cell ids (cardinality)")
+    parser.add_argument("--null-rate", type=float, default=0.0, help="fraction of missing values per column")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the best is kept")
+    parser.add_argument("--optimize-dtypes", action="store_true", help="optimize column types before the query stages")
+    parser.add_argument("--workdir", help="directory of the generated files (kept for reuse)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="results JSON of an earlier run")
+    args = parser.parse_args(argv)
+
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "workdir")}
+    benchmark = Benchmark(args.repeat, args.workdir)
+    for rows in [int(value) for value in args.rows.split(",")]:
+        benchmark.run_dataset(rows, args.extra_columns, args.regions, args.cells, args.null_rate, args.seed, args.optimize_dtypes)
+
+    report = {"environment": environment(), "parameters": params, "results": benchmark.results}
+    with open(args.output, 'w', encoding='utf-8') as out:
+        json.dump(report, out, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline:
+            compare(benchmark.results, json.load(baseline))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,17 +4,40 @@ import numpy as np
 import json
 import re
 import io
+import os
+import sys
+import time
+import glob
+import argparse
+import atexit
 import base64
+import copy
+import gzip
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import pickle
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, List, Any, Union, Optional
 
-# Set pageUI ) configuration
-st.set_page_config(
-    page_title="CSV Data Retrieval and Conversion Tool-China mobile",
-    page_icon="??",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Optional columnar backend (Arrow IPC files, memory-mapped)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 # Custom CSS styles for UI
 def load_css():
@@ -96,6 +119,1827 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
+# Default number of rows read per chunk in streaming mode
+DEFAULT_CHUNK_SIZE = 200000
+
+# Load-time dtype optimization and schema profiles
+# Distinct/row ratio up to which string columns become categoricals
+CATEGORY_MAX_RATIO = 0.5
+# Only ISO dates are parsed, their text form is unchanged by parsing
+DATE_FORMAT = '%Y-%m-%d'
+
+def is_numeric_column(series):
+    #"""Integer or float column, booleans excluded"""
+    return pd.api.types.is_integer_dtype(series.dtype) or pd.api.types.is_float_dtype(series.dtype)
+
+def is_date_column(series):
+    #"""Column parsed from ISO date text"""
+    return pd.api.types.is_datetime64_any_dtype(series.dtype)
+
+def rewind(file):
+    #"""Move an upload buffer back to its start"""
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return file
+
+def parse_date_column(series):
+    #"""Parse a text column of ISO dates, None unless every value prints back unchanged"""
+    values = series.dropna()
+    if len(values) == 0 or not values.iloc[:1000].astype(str).str.fullmatch(r'\d{4}-\d{2}-\d{2}').all():
+        return None
+    parsed = pd.to_datetime(series, format=DATE_FORMAT, errors='coerce')
+    if parsed.notna().sum() != len(values):
+        return None
+    if not (parsed.dropna().dt.strftime(DATE_FORMAT) == values.astype(str)).all():
+        return None
+    return parsed
+
+def ordered_categorical(series):
+    #"""Dictionary-encode a string column, categories ordered as the strings sort"""
+    return series.astype(pd.CategoricalDtype(sorted(series.dropna().unique()), ordered=True))
+
+def memory_bytes(df):
+    #"""Memory used by a frame, including string contents"""
+    return int(df.memory_usage(deep=True).sum())
+
+def estimate_bytes(df, sample_rows=1000):
+    #"""Memory used by a frame, string contents extrapolated from evenly spaced rows"""
+    if len(df) <= sample_rows:
+        return memory_bytes(df)
+    sample = df.iloc[::len(df) // sample_rows]
+    contents = sample.memory_usage(deep=True).sum() - sample.memory_usage(deep=False).sum()
+    return int(df.memory_usage(deep=False).sum() + contents * len(df) / len(sample))
+
+def optimize_dtypes(df):
+    #"""Downcast integers, encode low-cardinality strings and parse dates in place, returns the schema"""
+    schema = {}
+    for col in df.columns:
+        series = df[col]
+        kind = str(series.dtype)
+        if pd.api.types.is_integer_dtype(series.dtype):
+            series = pd.to_numeric(series, downcast='integer')
+            kind = str(series.dtype)
+        elif series.dtype == object:
+            parsed = parse_date_column(series)
+            if parsed is not None:
+                series = parsed
+                kind = 'date'
+            elif series.nunique() <= len(series) * CATEGORY_MAX_RATIO:
+                try:
+                    series = ordered_categorical(series)
+                    kind = 'category'
+                except TypeError:
+                    # Mixed value types cannot be ordered
+                    pass
+        df[col] = series
+        schema[col] = kind
+    return schema
+
+def read_csv_with_schema(file, schema, parser=None):
+    #"""Parse a CSV with a saved schema profile instead of inferring types"""
+    dtypes = {}
+    for col, kind in schema.items():
+        dtypes[col] = object if kind == 'date' else kind
+    df = parser.read(file, dtype=dtypes) if parser is not None else pd.read_csv(file, dtype=dtypes)
+    for col, kind in schema.items():
+        if kind == 'date':
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT)
+        elif kind == 'category':
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories), ordered=True)
+    return df
+
+def dates_as_text(df):
+    #"""Render parsed date columns back to their original text for export"""
+    dates = {col: df[col].dt.strftime(DATE_FORMAT) for col in df.columns if is_date_column(df[col])}
+    return df.assign(**dates) if dates else df
+
+# CSV parser backends: the pandas C engine, or the multithreaded Arrow reader producing the same frame
+ARROW_BLOCK_SIZE = 8 << 20
+# Missing value markers of pandas.read_csv
+NA_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+             "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+class ParserMismatch(ValueError):
+    #"""The Arrow reader would not produce the frame of pandas.read_csv"""
+    pass
+
+# Server-side files in the UI are off unless CSV_FILTER_SERVER_ROOT names the directory they may come from
+SERVER_ROOT = os.environ.get("CSV_FILTER_SERVER_ROOT")
+
+def inside_root(path, root):
+    #"""True when a path resolves (symbolic links included) to the root directory or below it"""
+    root = os.path.realpath(root)
+    return os.path.commonpath([os.path.realpath(path), root]) == root
+
+def is_path(file):
+    #"""True for a server-side file path, False for an upload buffer"""
+    return isinstance(file, (str, os.PathLike))
+
+class PandasParser:
+    name = "pandas"
+    
+    def __init__(self, encoding="utf-8"):
+        self.encoding = encoding
+    
+    def read(self, file, dtype=None, nrows=None):
+        #"""Parse a whole CSV (or its first rows), paths are memory-mapped"""
+        return pd.read_csv(file, dtype=dtype, nrows=nrows, encoding=self.encoding, memory_map=is_path(file))
+    
+    def read_chunks(self, file, chunk_size, usecols=None):
+        #"""Iterate over the CSV in frames of chunk_size rows"""
+        return pd.read_csv(file, chunksize=chunk_size, usecols=usecols, encoding=self.encoding)
+
+class ArrowParser(PandasParser):
+    name = "pyarrow"
+    
+    def __init__(self, encoding="utf-8", block_size=ARROW_BLOCK_SIZE, threads=None):
+        super().__init__(encoding)
+        self.block_size = block_size
+        self.threads = threads
+    
+    def open(self, file):
+        #"""Arrow input of a path (memory-mapped) or an upload buffer (zero-copy when possible)"""
+        if is_path(file):
+            return pa.memory_map(os.fspath(file))
+        if hasattr(file, 'getbuffer'):
+            return pa.BufferReader(file.getbuffer())
+        if isinstance(file, io.TextIOBase):
+            # Arrow only reads bytes
+            return pa.BufferReader(rewind(file).read().encode(self.encoding))
+        return rewind(file)
+    
+    def arrow_type(self, kind):
+        #"""Arrow column type of a pandas dtype of a schema profile"""
+        if kind == 'category':
+            return pa.dictionary(pa.int32(), pa.string())
+        if kind in (object, 'object'):
+            return pa.string()
+        return pa.from_numpy_dtype(np.dtype(kind))
+    
+    def read(self, file, dtype=None, nrows=None):
+        #"""Parse a whole CSV on all cores, first rows only are read by pandas"""
+        if nrows is not None:
+            return super().read(file, dtype, nrows)
+        if self.threads:
+            # Arrow's CPU pool is process-wide
+            pa.set_cpu_count(self.threads)
+        read_options = pacsv.ReadOptions(use_threads=True, block_size=self.block_size, encoding=self.encoding)
+        column_types = {col: self.arrow_type(kind) for col, kind in (dtype or {}).items()}
+        
+        # Arrow infers ISO dates and times, pandas keeps their text: read those columns as strings
+        with pacsv.open_csv(self.open(file), read_options=read_options) as reader:
+            for field in reader.schema:
+                if field.name not in column_types and pa.types.is_temporal(field.type):
+                    column_types[field.name] = pa.string()
+        convert_options = pacsv.ConvertOptions(column_types=column_types, null_values=NA_VALUES, strings_can_be_null=True)
+        table = pacsv.read_csv(self.open(file), read_options=read_options, convert_options=convert_options)
+        mismatch = self.mismatch(table)
+        if mismatch is not None:
+            raise ParserMismatch(mismatch)
+        df = table.to_pandas()
+        
+        # Missing strings and booleans are NaN, as with pandas
+        for col, column in zip(table.column_names, table.columns):
+            if column.null_count and df[col].dtype == object:
+                df[col] = df[col].where(df[col].notna(), np.nan)
+        return df
+
+    def mismatch(self, table):
+        #"""Why pandas would parse the same text differently, None when the frames match"""
+        names = table.column_names
+        # pandas renames repeated headers to a, a.1, ...
+        if len(set(names)) < len(names):
+            return "repeated column names"
+        for name, column in zip(names, table.columns):
+            # pandas reads columns without values as float64
+            if pa.types.is_null(column.type):
+                return f"column {name} has no values"
+            # Integers beyond int64 become doubles in Arrow, uint64 or text in pandas
+            if pa.types.is_floating(column.type) and column.null_count < len(column):
+                bounds = pc.min_max(column)
+                if max(abs(bounds['min'].as_py()), abs(bounds['max'].as_py())) >= 2 ** 63:
+                    return f"column {name} has values beyond int64"
+        return None
+
+PARSER_BACKENDS = {
+    "pandas": PandasParser,
+    "pyarrow": ArrowParser
+}
+
+# Per-stage profiling of query execution
+logger = logging.getLogger("csv_filter")
+
+def rule_label(filter_rule):
+    #"""Short text of a filter rule"""
+    return f"{filter_rule['column']} {filter_rule['operator']} {filter_rule['value']!r}"
+
+class StageProfiler:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.events = []
+        self.owns_tracing = False
+        self.origin = time.perf_counter()
+        self.cpu_origin = time.process_time()
+        self.wall = None
+        self.cpu = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracing = True
+    
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        #"""Time one stage, the caller sets entry['rows_out']"""
+        entry = {"name": name, "rows_in": rows_in, "rows_out": None, "peak_bytes": None}
+        # Stages are not nested, so the traced peak can be reset per stage
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield entry
+        finally:
+            entry['start'] = wall - self.origin
+            entry['wall'] = time.perf_counter() - wall
+            entry['cpu'] = time.process_time() - cpu
+            if tracing:
+                entry['peak_bytes'] = max(tracemalloc.get_traced_memory()[1] - base, 0)
+            self.events.append(entry)
+    
+    def finish(self):
+        #"""Close the run, stopping memory tracing when this profiler started it"""
+        self.wall = time.perf_counter() - self.origin
+        self.cpu = time.process_time() - self.cpu_origin
+        if self.owns_tracing:
+            tracemalloc.stop()
+            self.owns_tracing = False
+    
+    def summary(self):
+        #"""One row per stage, stages repeated per chunk are summed"""
+        rows = OrderedDict()
+        for event in self.events:
+            row = rows.setdefault(event['name'], {"stage": event['name'], "calls": 0, "wall_ms": 0.0, "cpu_ms": 0.0,
+                                                  "rows_in": None, "rows_out": None, "peak_mb": None})
+            row['calls'] += 1
+            row['wall_ms'] += event['wall'] * 1000
+            row['cpu_ms'] += event['cpu'] * 1000
+            for key in ('rows_in', 'rows_out'):
+                if event[key] is not None:
+                    row[key] = (row[key] or 0) + int(event[key])
+            if event['peak_bytes'] is not None:
+                row['peak_mb'] = max(row['peak_mb'] or 0.0, event['peak_bytes'] / 1024 ** 2)
+        return list(rows.values())
+    
+    def to_frame(self):
+        #"""Stage table for display"""
+        return pd.DataFrame(self.summary(), columns=["stage", "calls", "wall_ms", "cpu_ms", "rows_in", "rows_out", "peak_mb"])
+    
+    def to_json(self):
+        #"""Stage table and individual stage events as JSON"""
+        return json.dumps({"wall_ms": (self.wall or 0) * 1000, "cpu_ms": (self.cpu or 0) * 1000,
+                           "stages": self.summary(), "events": self.events}, indent=2)
+    
+    def chrome_trace(self):
+        #"""Trace Event Format JSON, opens in chrome://tracing or Perfetto"""
+        events = []
+        for event in self.events:
+            events.append({
+                "name": event['name'],
+                "cat": "stage",
+                "ph": "X",
+                "ts": event['start'] * 1e6,
+                "dur": event['wall'] * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+                "args": {
+                    "rows_in": event['rows_in'],
+                    "rows_out": event['rows_out'],
+                    "cpu_ms": event['cpu'] * 1000,
+                    "peak_mb": event['peak_bytes'] / 1024 ** 2 if event['peak_bytes'] is not None else None
+                }
+            })
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+    
+    def log(self):
+        #"""Log the stage table of the run"""
+        logger.info("query profile: %.1f ms wall, %.1f ms CPU", (self.wall or 0) * 1000, (self.cpu or 0) * 1000)
+        for row in self.summary():
+            peak = f", peak {row['peak_mb']:.1f} MB" if row['peak_mb'] is not None else ""
+            logger.info("  %s: %d call(s), %.1f ms wall, %.1f ms CPU, rows %s -> %s%s",
+                        row['stage'], row['calls'], row['wall_ms'], row['cpu_ms'], row['rows_in'], row['rows_out'], peak)
+
+def enable_profile_logging():
+    #"""Send the logged stage profiles to stderr"""
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+
+@contextmanager
+def profile_stage(profiler, name, rows_in=None):
+    #"""profiler.stage, or a no-op when the run is not profiled"""
+    if profiler is None:
+        yield {}
+        return
+    with profiler.stage(name, rows_in) as entry:
+        yield entry
+
+# Filter rule evaluation (shared by in-memory and chunked execution)
+def convert_filter_value(series, value):
+    #"""Attempt to convert the filter value to the column type"""
+    try:
+        if is_numeric_column(series):
+            value = float(value)
+    except:
+        pass
+    return value
+
+def canonical_date(value):
+    #"""Timestamp of an ISO date string, None for any other text"""
+    try:
+        timestamp = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        return None
+    return timestamp if timestamp.strftime(DATE_FORMAT) == value else None
+
+def build_filter_mask(df, filter_rule):
+    #"""Build the boolean row mask of one filter rule"""
+    return build_series_mask(df[filter_rule['column']], filter_rule)
+
+def build_series_mask(series, filter_rule):
+    #"""Build the boolean mask of one filter rule on its column"""
+    operator = filter_rule['operator']
+    value = convert_filter_value(series, filter_rule['value'])
+
+    # Dictionary-encoded column: evaluate once per distinct value
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return dictionary_filter_mask(series, filter_rule)
+
+    # Parsed dates compare natively against ISO dates, otherwise as their original text
+    if is_date_column(series) and operator not in ('isnull', 'notnull'):
+        timestamp = canonical_date(value)
+        if operator == 'in':
+            dates = [canonical_date(v.strip()) for v in value.split(',')]
+            return series.isin([date for date in dates if date is not None])
+        if timestamp is not None and operator in ('eq', 'ne', 'gt', 'ge', 'lt', 'le'):
+            value = timestamp
+        else:
+            series = series.dt.strftime(DATE_FORMAT).astype(object).where(series.notna(), np.nan)
+
+    if operator == 'eq':
+        return series == value
+    elif operator == 'ne':
+        return series != value
+    elif operator == 'gt':
+        return series > value
+    elif operator == 'ge':
+        return series >= value
+    elif operator == 'lt':
+        return series < value
+    elif operator == 'le':
+        return series <= value
+    elif operator == 'contains':
+        return series.astype(str).str.contains(str(value), na=False)
+    elif operator == 'regex':
+        return series.astype(str).str.match(str(value), na=False)
+    elif operator == 'isnull':
+        return series.isna()
+    elif operator == 'notnull':
+        return series.notna()
+    elif operator == 'in':
+        values = [v.strip() for v in value.split(',')]
+        return series.isin(values)
+    return pd.Series(True, index=series.index)
+
+def dictionary_filter_mask(series, filter_rule):
+    #"""Evaluate a rule on the dictionary values and map the result back to rows by code"""
+    # The extra trailing entry stands for missing values, whose code is -1
+    dictionary = pd.concat([pd.Series(series.cat.categories), pd.Series([np.nan])], ignore_index=True)
+    lookup = mask_to_array(build_series_mask(dictionary, filter_rule))
+    return pd.Series(lookup[series.cat.codes.to_numpy()], index=series.index)
+
+# Relative per-row cost of filter operators, used to order fused filters
+FILTER_COSTS = {
+    "isnull": 1,
+    "notnull": 1,
+    "eq": 1,
+    "ne": 1,
+    "gt": 1,
+    "ge": 1,
+    "lt": 1,
+    "le": 1,
+    "in": 2,
+    "contains": 20,
+    "regex": 30
+}
+
+def mask_to_array(mask):
+    #"""Convert a filter mask to a numpy bool array, missing values count as False"""
+    return mask.to_numpy(dtype=bool, na_value=False)
+
+# Rows per block of a string rule evaluated with progress reporting
+FILTER_BLOCK_ROWS = 500000
+
+def rule_mask(series, filter_rule, progress=None):
+    #"""Mask array of one rule, string scans run in blocks between progress checkpoints"""
+    stage = f"filter {rule_label(filter_rule)}"
+    if progress is not None:
+        progress(stage, 0, 0.0)
+    if (progress is None or filter_rule['operator'] not in ('contains', 'regex') or len(series) <= FILTER_BLOCK_ROWS
+            or isinstance(series.dtype, pd.CategoricalDtype)):
+        return mask_to_array(build_series_mask(series, filter_rule))
+    blocks = []
+    for start in range(0, len(series), FILTER_BLOCK_ROWS):
+        blocks.append(mask_to_array(build_series_mask(series.iloc[start:start + FILTER_BLOCK_ROWS], filter_rule)))
+        done = min(start + FILTER_BLOCK_ROWS, len(series))
+        progress(stage, done, done / len(series))
+    return np.concatenate(blocks)
+
+def fused_filter_mask(df, filters, encoded=None, profiler=None, progress=None):
+    #"""Combine conjunctive filter rules into one mask, later rules only see surviving rows"""
+    encoded = encoded or {}
+    mask = None
+    for filter_rule in filters:
+        col = filter_rule['column']
+        series = encoded[col] if col in encoded else df[col]
+        if mask is None:
+            with profile_stage(profiler, f"filter {rule_label(filter_rule)}", len(series)) as entry:
+                mask = rule_mask(series, filter_rule, progress)
+                entry['rows_out'] = int(mask.sum())
+            continue
+        alive = np.flatnonzero(mask)
+        if len(alive) == 0:
+            break
+        subset = series if len(alive) == len(mask) else series.iloc[alive]
+        with profile_stage(profiler, f"filter {rule_label(filter_rule)}", len(subset)) as entry:
+            matched = rule_mask(subset, filter_rule, progress)
+            mask[alive] = matched
+            entry['rows_out'] = int(matched.sum())
+    return mask
+
+# How a filter rule reads its column other than a full scan
+ACCESS_LABELS = {
+    "hash": "hash index",
+    "sorted": "sorted index",
+    "dictionary": "dictionary matching"
+}
+
+# Distinct/row ratio up to which string columns are dictionary-encoded for matching
+DICTIONARY_MAX_RATIO = 0.5
+
+# Filtered row positions kept per loaded frame, a query whose rules include a kept set only evaluates the rest.
+# Kept positions and the last selected frame together stay within a byte budget.
+STAGE_CACHE_ENTRIES = 8
+STAGE_CACHE_BYTES = 256 << 20
+
+# Column indexes, built once per loaded dataset and reused by later queries
+
+def compact_positions(positions):
+    #"""Store row positions as int32 when they fit"""
+    if len(positions) == 0 or positions.max() < 2 ** 31:
+        return positions.astype(np.int32)
+    return positions
+
+# Hash index for eq / in: row positions grouped by distinct value
+class HashIndex:
+    def __init__(self, series):
+        codes, self.uniques = pd.factorize(series)
+        self.order = compact_positions(np.argsort(codes, kind='stable'))
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.uniques))
+        # Missing values have code -1 and are sorted first
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]) + int((codes < 0).sum())
+
+    def lookup(self, values):
+        #"""Sorted row positions whose value is one of values"""
+        # Match the index dtype so the lookup reuses its hash table
+        if pd.api.types.is_integer_dtype(self.uniques.dtype):
+            info = np.iinfo(self.uniques.dtype)
+            values = [int(v) for v in values
+                      if isinstance(v, (int, float)) and float(v).is_integer() and info.min <= v <= info.max]
+        elif pd.api.types.is_float_dtype(self.uniques.dtype):
+            values = [float(v) for v in values if isinstance(v, (int, float))]
+        codes = self.uniques.get_indexer(pd.Index(values, dtype=self.uniques.dtype)) if values else []
+        parts = [self.order[self.offsets[code]:self.offsets[code + 1]] for code in set(codes) if code >= 0]
+        if not parts:
+            return np.array([], dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts))
+
+# Sorted index for gt / ge / lt / le on numeric columns
+class SortedIndex:
+    def __init__(self, series):
+        values = series.to_numpy()
+        # Missing values are sorted last and never match a comparison
+        self.order = compact_positions(np.argsort(values, kind='stable'))
+        self.sorted_values = values[self.order[:int(series.notna().sum())]]
+
+    def range_bounds(self, operator, value):
+        #"""Slice of the sorted order matching a comparison"""
+        n = len(self.sorted_values)
+        if operator == 'gt':
+            return np.searchsorted(self.sorted_values, value, side='right'), n
+        elif operator == 'ge':
+            return np.searchsorted(self.sorted_values, value, side='left'), n
+        elif operator == 'lt':
+            return 0, np.searchsorted(self.sorted_values, value, side='left')
+        return 0, np.searchsorted(self.sorted_values, value, side='right')
+
+    def lookup(self, lo, hi):
+        #"""Sorted row positions of a slice of the sorted order"""
+        return np.sort(self.order[lo:hi])
+
+# Mergeable group aggregates: per-chunk partial states that combine exactly
+# mean/std are carried as (count, mean, m2) moments and merged with Chan's formula
+AGG_STATE_FIELDS = {
+    "sum": ["sum"],
+    "count": ["count"],
+    "min": ["min"],
+    "max": ["max"],
+    "mean": ["count", "mean", "m2"],
+    "std": ["count", "mean", "m2"]
+}
+
+def build_agg_dict(agg_config):
+    #"""Group aggregation rules by column, keeping rule order"""
+    agg_dict = {}
+    for agg in agg_config:
+        col = agg['column']
+        func = agg['function']
+        if col not in agg_dict:
+            agg_dict[col] = []
+        agg_dict[col].append(func)
+    return agg_dict
+
+def partial_aggregate(df, group_columns, agg_config, dropna=True):
+    #"""Compute the mergeable per-group aggregate state of one chunk"""
+    # Categorical values only support count / min / max, others run on the decoded values
+    decoded = {col: df[col].astype(object) for col, funcs in build_agg_dict(agg_config).items()
+               if isinstance(df[col].dtype, pd.CategoricalDtype)
+               and any(func not in ('count', 'min', 'max') for func in funcs)}
+    if decoded:
+        df = df.assign(**decoded)
+    grouped = df.groupby(group_columns, observed=True, dropna=dropna)
+    state = {}
+    for col, funcs in build_agg_dict(agg_config).items():
+        fields = []
+        for func in funcs:
+            for field in AGG_STATE_FIELDS[func]:
+                if field not in fields:
+                    fields.append(field)
+        series = grouped[col]
+        count = series.count()
+        for field in fields:
+            if field == 'count':
+                state[(col, 'count')] = count
+            elif field == 'mean':
+                state[(col, 'mean')] = series.mean().where(count > 0, 0.0)
+            elif field == 'm2':
+                state[(col, 'm2')] = (series.var(ddof=0) * count).where(count > 0, 0.0)
+            else:
+                state[(col, field)] = series.agg(field)
+    return pd.DataFrame(state)
+
+def merge_partial_aggregates(states, levels=None):
+    #"""Merge partial aggregate states of the same grouping into one, or into a coarser grouping of some of its levels"""
+    combined = pd.concat(states)
+    if levels is None:
+        levels = list(range(combined.index.nlevels))
+    merged = {}
+    for col, field in combined.columns:
+        values = combined[(col, field)]
+        if field in ('count', 'sum'):
+            merged[(col, field)] = values.groupby(level=levels, observed=True).sum()
+        elif field == 'min':
+            merged[(col, field)] = values.groupby(level=levels, observed=True).min()
+        elif field == 'max':
+            merged[(col, field)] = values.groupby(level=levels, observed=True).max()
+        elif field == 'mean':
+            count = combined[(col, 'count')]
+            total = count.groupby(level=levels, observed=True).sum()
+            mean = ((count * values).groupby(level=levels, observed=True).sum() / total).where(total > 0, 0.0)
+            # m2 = sum(m2_i + n_i * (mean_i - mean)^2), with the merged mean of each state's group
+            state_mean = ((count * values).groupby(level=levels, observed=True).transform('sum')
+                          / count.groupby(level=levels, observed=True).transform('sum'))
+            shift = count * (values - state_mean.where(state_mean.notna(), 0.0)) ** 2
+            merged[(col, 'mean')] = mean
+            merged[(col, 'm2')] = (combined[(col, 'm2')] + shift).groupby(level=levels, observed=True).sum()
+    return pd.DataFrame(merged, columns=combined.columns)
+
+def finalize_aggregates(state, agg_config):
+    #"""Turn merged aggregate state into the group aggregation result"""
+    result = {}
+    for col, funcs in build_agg_dict(agg_config).items():
+        for func in funcs:
+            if func in ('sum', 'count', 'min', 'max'):
+                result[(col, func)] = state[(col, func)]
+            elif func == 'mean':
+                result[(col, func)] = state[(col, 'mean')].where(state[(col, 'count')] > 0)
+            elif func == 'std':
+                count = state[(col, 'count')]
+                result[(col, func)] = np.sqrt(state[(col, 'm2')] / (count - 1)).where(count > 1)
+    return pd.DataFrame(result, index=state.index).reset_index()
+
+# Materialized rollups: mergeable aggregate states of frequently used groupings, kept per loaded frame.
+# A grouping of some of the rollup keys, filtered on rollup keys only, is merged from the rollup rows
+ROLLUP_MIN_USES = 2
+# Executed grouped queries remembered for the use counts
+ROLLUP_HISTORY = 50
+# Filter columns with up to this many distinct values in the planner sample, and few relative to it, become rollup keys too
+ROLLUP_MAX_KEY_VALUES = 1000
+# Rollups with more rows than this share of the frame are not kept
+ROLLUP_MAX_RATIO = 0.2
+ROLLUP_MAX_ENTRIES = 4
+# Fields of every aggregate function, so that one rollup answers any of them
+ROLLUP_FUNCTIONS = ["sum", "min", "max", "std"]
+
+def flatten_columns(df):
+    #"""Flattening multi-level column names"""
+    df.columns = ['_'.join(col).strip() for col in df.columns.values]
+    return df
+
+# k-way merge of sorted runs, each run given as an iterator of sorted blocks
+def merge_sorted_runs(readers, block_counts, by, ascending):
+    #"""Yield the merged blocks, ties keep run order so the merge is stable"""
+    remaining = list(block_counts)
+    buffers = {}
+    for i, reader in enumerate(readers):
+        if remaining[i] > 0:
+            buffers[i] = next(reader)
+            remaining[i] -= 1
+
+    while buffers:
+        run_ids = list(buffers.keys())
+        blocks = [buffers[i] for i in run_ids]
+        lengths = [len(block) for block in blocks]
+        combined = pd.concat(blocks)
+        labels = combined.index
+        combined.index = pd.RangeIndex(len(combined))
+        owner = np.repeat(run_ids, lengths)
+        position = np.concatenate([np.arange(n) for n in lengths])
+
+        ordered = combined.sort_values(by=by, ascending=ascending, kind='mergesort')
+        order = ordered.index.to_numpy()
+        ordered.index = labels[order]
+        owner = owner[order]
+        position = position[order]
+
+        # Rows up to the smallest last row of a run with unread blocks are final
+        cut = len(ordered)
+        for i, n in zip(run_ids, lengths):
+            if remaining[i] > 0:
+                last = np.flatnonzero((owner == i) & (position == n - 1))[0] + 1
+                cut = min(cut, last)
+
+        if cut > 0:
+            yield ordered.iloc[:cut]
+
+        rest = ordered.iloc[cut:]
+        rest_owner = owner[cut:]
+        buffers = {}
+        for i in run_ids:
+            block = rest[rest_owner == i]
+            if len(block) == 0 and remaining[i] > 0:
+                block = next(readers[i])
+                remaining[i] -= 1
+            if len(block) > 0:
+                buffers[i] = block
+
+# External merge sort for data larger than memory
+class ExternalSorter:
+    def __init__(self, by, ascending, block_rows=10000, fan_in=64, temp_dir=None):
+        self.by = by
+        self.ascending = ascending
+        self.block_rows = block_rows
+        self.fan_in = fan_in
+        self.temp_dir = tempfile.mkdtemp(prefix="csv_sort_", dir=temp_dir)
+        self.runs = []
+        self.run_counter = 0
+
+    def add(self, df):
+        #"""Sort one chunk and spill it to disk as a sorted run"""
+        if len(df) == 0:
+            return
+        df = df.sort_values(by=self.by, ascending=self.ascending, kind='mergesort')
+        self.runs.append(self._write_run(
+            df.iloc[start:start + self.block_rows] for start in range(0, len(df), self.block_rows)
+        ))
+
+    def _write_run(self, blocks):
+        #"""Write blocks of one sorted run, returns (path, block count)"""
+        path = os.path.join(self.temp_dir, f"run_{self.run_counter}.pkl")
+        self.run_counter += 1
+        n_blocks = 0
+        with open(path, 'wb') as f:
+            for block in blocks:
+                pickle.dump(block, f, protocol=pickle.HIGHEST_PROTOCOL)
+                n_blocks += 1
+        return path, n_blocks
+
+    def _read_run(self, run):
+        #"""Read the blocks of one sorted run back and delete it"""
+        path, n_blocks = run
+        with open(path, 'rb') as f:
+            for _ in range(n_blocks):
+                yield pickle.load(f)
+        os.remove(path)
+
+    def _merge_runs(self, runs):
+        #"""k-way merge of sorted runs, holding one block per run in memory"""
+        return merge_sorted_runs([self._read_run(run) for run in runs], [run[1] for run in runs], self.by, self.ascending)
+
+    def merge(self):
+        #"""Yield the globally sorted data block by block"""
+        try:
+            runs = self.runs
+            # Multi-pass merge keeps the number of open runs bounded
+            while len(runs) > self.fan_in:
+                runs = [self._write_run(self._merge_runs(runs[i:i + self.fan_in]))
+                        for i in range(0, len(runs), self.fan_in)]
+            for block in self._merge_runs(runs):
+                yield block
+        finally:
+            self.close()
+
+    def close(self):
+        #"""Remove the spilled runs, also of a sort abandoned before its merge"""
+        self.runs = []
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Top-K selection: the first rows of a stable multi-key sort without sorting every row
+PREVIEW_ROWS = 20
+
+def sort_rank(series, ascending):
+    #"""Integer or float keys ordering the rows like sort_values on one column, missing values last"""
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufMm' and dtype != np.uint64:
+        values = series.to_numpy()
+        if dtype.kind == 'f':
+            if not np.isinf(values).any():
+                keys = values if ascending else -values
+                missing = np.isnan(values)
+                return np.where(missing, np.inf, keys) if missing.any() else keys
+        elif not (dtype.kind in 'Mm' and series.hasnans):
+            keys = values.view(np.int64) if dtype.kind in 'Mm' else values.astype(np.int64)
+            # Bitwise not reverses the order of integers without overflow
+            return keys if ascending else ~keys
+    
+    # Categories are already in sort order, other types are ranked by their sorted distinct values
+    if isinstance(dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy().astype(np.int64)
+        count = len(dtype.categories)
+    else:
+        codes, uniques = pd.factorize(series, sort=True)
+        codes = codes.astype(np.int64)
+        count = len(uniques)
+    keys = codes if ascending else count - 1 - codes
+    return np.where(codes < 0, count, keys)
+
+def top_k_positions(df, by, ascending, k):
+    #"""Sorted row positions of the first k rows of the stable sort, one partial selection per key"""
+    pool = np.arange(len(df))
+    chosen = []
+    need = k
+    for col, asc in zip(by, ascending):
+        if need >= len(pool):
+            break
+        keys = sort_rank(df[col].iloc[pool] if len(pool) < len(df) else df[col], asc)
+        kth = np.partition(keys, need - 1)[need - 1]
+        before = pool[keys < kth]
+        chosen.append(before)
+        need -= len(before)
+        # Rows tied with the k-th value are decided by the next key
+        pool = pool[keys == kth]
+    # Remaining ties keep their original order
+    chosen.append(pool[:need])
+    return np.sort(np.concatenate(chosen))
+
+# Lazy sorted result: previews and pages use top-K selection, the full sort runs on first full access
+class LazyResult:
+    def __init__(self, df, sort=None):
+        # Result rows in source order, sort as (columns, ascending)
+        self.df = df
+        self.sort = sort
+        self.sorted_df = df if sort is None else None
+    
+    def __len__(self):
+        return len(self.df)
+    
+    @property
+    def columns(self):
+        return self.df.columns
+    
+    def materialize(self):
+        #"""Full result in its final order"""
+        if self.sorted_df is None:
+            sort_columns, ascending = self.sort
+            self.sorted_df = self.df.sort_values(by=sort_columns, ascending=ascending, kind='mergesort')
+            # The unsorted rows are no longer needed
+            self.df = self.sorted_df
+        return self.sorted_df
+    
+    def head(self, rows=PREVIEW_ROWS):
+        #"""First rows in the final order"""
+        if self.sorted_df is not None:
+            return self.sorted_df.iloc[:rows]
+        # Selecting most of the rows costs more than sorting them
+        if rows * 4 >= len(self.df):
+            return self.materialize().iloc[:rows]
+        sort_columns, ascending = self.sort
+        top = self.df.iloc[top_k_positions(self.df, sort_columns, ascending, rows)]
+        return top.sort_values(by=sort_columns, ascending=ascending, kind='mergesort')
+    
+    def page(self, number, rows=PREVIEW_ROWS):
+        #"""Rows of a 0-based page in the final order"""
+        start = number * rows
+        return self.head(start + rows).iloc[start:]
+
+def remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+@st.cache_resource
+def private_temp_dir(name):
+    #"""Temporary directory of this server process for one kind of file, accessible by its owner only"""
+    path = tempfile.mkdtemp(prefix=f"csv_data_retrieval_{name}_")
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+# Disk-backed result of a chunked run: blocks in their final order are appended to a spill file,
+# pages read back only the blocks that hold them and exports stream them one at a time
+class SpilledResult:
+    def __init__(self, temp_dir=None):
+        fd, self.path = tempfile.mkstemp(prefix="csv_result_", suffix=".pkl", dir=temp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        # File offset and row count of each block
+        self.offsets = []
+        self.lengths = []
+        # Zero rows with the result columns, and one row with a value of each column for Parquet type inference
+        self.template = None
+        self.typed = {}
+        self.finalizer = weakref.finalize(self, remove_file, self.path)
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    @property
+    def columns(self):
+        return self.template.columns
+
+    def append(self, block):
+        #"""Write the next block of rows"""
+        if self.template is None:
+            self.template = block.iloc[:0]
+        if len(block) == 0:
+            return
+        for col in block.columns:
+            if col not in self.typed:
+                present = block[col].notna().to_numpy()
+                if present.any():
+                    self.typed[col] = block.iloc[[int(present.argmax())]]
+        self.offsets.append(self.file.tell())
+        self.lengths.append(len(block))
+        pickle.dump(block, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def discard(self):
+        #"""Remove the spill file of a result that will not be completed"""
+        self.file.close()
+        self.finalizer()
+
+    def close(self, empty):
+        #"""Finish writing, empty gives the columns when no block was appended"""
+        self.file.close()
+        if self.template is None:
+            self.template = empty.iloc[:0]
+        return self
+
+    def blocks(self):
+        #"""Yield the blocks in order, one in memory at a time"""
+        with open(self.path, 'rb') as f:
+            for _ in self.lengths:
+                yield pickle.load(f)
+
+    def rows(self, start, stop):
+        #"""Rows start:stop in the final order"""
+        ends = np.cumsum(self.lengths)
+        first = int(np.searchsorted(ends, start, side='right'))
+        position = int(ends[first - 1]) if first else 0
+        frames = []
+        with open(self.path, 'rb') as f:
+            for i in range(first, len(self.lengths)):
+                if position >= stop:
+                    break
+                f.seek(self.offsets[i])
+                block = pickle.load(f)
+                frames.append(block.iloc[max(start - position, 0):stop - position])
+                position += self.lengths[i]
+        return pd.concat(frames) if frames else self.template
+
+    def materialize(self):
+        #"""Full result in memory"""
+        frames = list(self.blocks())
+        return pd.concat(frames) if frames else self.template
+
+    def head(self, rows=PREVIEW_ROWS):
+        return self.rows(0, rows)
+
+    def page(self, number, rows=PREVIEW_ROWS):
+        #"""Rows of a 0-based page"""
+        return self.rows(number * rows, (number + 1) * rows)
+
+    def schema_frame(self):
+        #"""A few rows holding a value of every column that has one, for type inference"""
+        return pd.concat([self.template] + list(self.typed.values()))
+
+# Sampled preview: a uniform reservoir sample of the dataset, aggregates scaled up with 95% confidence intervals
+PREVIEW_SAMPLE_ROWS = 10000
+CONFIDENCE_Z = 1.96
+
+class ReservoirSample:
+    def __init__(self, capacity=PREVIEW_SAMPLE_ROWS, seed=0):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.frame = None
+        # Dataset row number of every sampled row
+        self.rows = np.empty(0, dtype=np.int64)
+    
+    def add(self, df):
+        #"""Offer the rows of a frame"""
+        self.offer(len(df), df.take)
+    
+    def offer(self, n, take):
+        #"""Offer the next n rows of the dataset, take(positions) returns the accepted ones as a frame"""
+        start = self.seen
+        self.seen += n
+        fill = min(max(self.capacity - start, 0), n)
+        # Algorithm R in one draw per row: row i replaces slot j ~ U[0, i] when j is inside the reservoir
+        later = np.arange(fill, n)
+        slots = (self.rng.random(len(later)) * (start + later + 1)).astype(np.int64)
+        kept = slots < self.capacity
+        positions = np.concatenate([np.arange(fill), later[kept]])
+        slots = np.concatenate([np.arange(start, start + fill), slots[kept]])
+        # A slot replaced twice keeps the later row
+        last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+        positions, slots = positions[last], slots[last]
+        
+        old = 0 if self.frame is None else len(self.frame)
+        owner = np.arange(min(self.seen, self.capacity))
+        owner[slots] = old + np.arange(len(slots))
+        piece = take(positions).reset_index(drop=True)
+        combined = piece if self.frame is None else pd.concat([self.frame, piece], ignore_index=True)
+        self.frame = combined.take(owner).reset_index(drop=True)
+        self.rows = np.concatenate([self.rows, start + positions])[owner]
+    
+    def sample(self):
+        #"""Sampled rows in dataset order"""
+        return self.frame.take(np.argsort(self.rows, kind='stable')).reset_index(drop=True)
+
+def sampled_chunks(chunks, reservoir):
+    #"""Pass (frame, fraction read) pairs through, offering every frame to the reservoir"""
+    for chunk, fraction in chunks:
+        if reservoir is not None:
+            reservoir.add(chunk)
+        yield chunk, fraction
+
+def population_correction(sample_rows, population):
+    #"""Finite population correction of a sample drawn without replacement, 0 when it holds every row"""
+    return (population - sample_rows) / (population - 1) if population > 1 else 0.0
+
+def estimate_count(matches, sample_rows, population):
+    #"""Rows of the population matching a condition, from the matching sampled rows, and the 95% half-width"""
+    p = matches / sample_rows if sample_rows else 0.0
+    spread = population * np.sqrt(p * (1 - p) / max(sample_rows, 1) * population_correction(sample_rows, population))
+    return p * population, CONFIDENCE_Z * spread
+
+def estimate_aggregates(df, group_columns, agg_config, sample_rows, population):
+    #"""Group aggregates of a filtered sample as population estimates, each followed by its 95% half-width"""
+    # count / mean / m2 moments give every interval, min and max are the sample extremes
+    moments = [{"column": agg['column'], "function": agg['function'] if agg['function'] in ('count', 'min', 'max') else 'mean'}
+               for agg in agg_config]
+    state = partial_aggregate(df, group_columns, moments)
+    fpc = population_correction(sample_rows, population)
+    result = {}
+    for agg in agg_config:
+        col, func = agg['column'], agg['function']
+        count = state[(col, 'count')] if (col, 'count') in state else None
+        if func == 'count':
+            estimate, half = estimate_count(count, sample_rows, population)
+        elif func == 'sum':
+            # Every sampled row adds its value inside the group and 0 outside it
+            total = count * state[(col, 'mean')]
+            row_mean = total / sample_rows
+            row_var = (state[(col, 'm2')] + count * state[(col, 'mean')] ** 2) / sample_rows - row_mean ** 2
+            estimate = total * population / sample_rows
+            half = CONFIDENCE_Z * population * np.sqrt(row_var.clip(lower=0) / sample_rows * fpc)
+        elif func == 'mean':
+            estimate = state[(col, 'mean')].where(count > 0)
+            half = CONFIDENCE_Z * np.sqrt(state[(col, 'm2')] / (count - 1) / count * fpc).where(count > 1)
+        elif func == 'std':
+            estimate = np.sqrt(state[(col, 'm2')] / (count - 1)).where(count > 1)
+            # Delta method with the fourth central moment, skewed data have wider intervals than normal theory gives
+            keys = [df[key] for key in group_columns]
+            values = df[col].astype(float)
+            centered = values - values.groupby(keys, observed=True).transform('mean')
+            m4 = (centered ** 4).groupby(keys, observed=True).mean()
+            half = CONFIDENCE_Z * np.sqrt((m4 - estimate ** 4).clip(lower=0) / count * fpc) / (2 * estimate)
+        else:
+            estimate = state[(col, func)]
+            half = pd.Series(np.nan, index=state.index)
+        result[f"{col}_{func}"] = estimate
+        result[f"{col}_{func} ±"] = half
+    return pd.DataFrame(result, index=state.index).reset_index()
+
+def source_size(file):
+    #"""Size in bytes of a seekable source, None when unknown"""
+    try:
+        position = file.tell()
+        size = file.seek(0, os.SEEK_END)
+        file.seek(position)
+        return size
+    except Exception:
+        return None
+
+# Fingerprint of a CSV source: size plus a fast content hash
+def fingerprint_file(file, block_size=1 << 20):
+    #"""Compute the content fingerprint of an upload buffer or file path"""
+    hasher = hashlib.blake2b(digest_size=16)
+    size = 0
+    handle = open(file, 'rb') if isinstance(file, (str, os.PathLike)) else file
+    try:
+        if hasattr(handle, 'seek'):
+            handle.seek(0)
+        while True:
+            block = handle.read(block_size)
+            if not block:
+                break
+            if isinstance(block, str):
+                block = block.encode('utf-8')
+            hasher.update(block)
+            size += len(block)
+    finally:
+        if handle is not file:
+            handle.close()
+        elif hasattr(handle, 'seek'):
+            handle.seek(0)
+    return f"{size}-{hasher.hexdigest()}"
+
+# Process-wide store of parsed datasets shared read-only by all sessions, deduplicated by fingerprint.
+# Sessions get zero-copy views and are tracked weakly, only idle datasets are LRU evicted over the budget
+DATASET_CACHE_BYTES = int(os.environ.get("CSV_FILTER_DATASET_BUDGET_MB", 4096)) << 20
+
+def freeze_frame(df):
+    #"""Frame on read-only views of the numeric and boolean columns, a write to a shared dataset raises instead of reaching other sessions"""
+    # Object buffers stay writable, pandas' string routines do not accept read-only ones, dates and extension types are kept as is
+    columns = {}
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufc":
+            # Read-only view of the column, the new frame is built on it without a copy
+            values = series.to_numpy(copy=False).view()
+            values.flags.writeable = False
+            series = pd.Series(values, index=df.index, copy=False)
+        columns[position] = series
+    # Positional keys keep duplicate column names
+    frozen = pd.DataFrame(columns, index=df.index, copy=False)
+    frozen.columns = df.columns
+    return frozen
+
+class DatasetCache:
+    def __init__(self, max_bytes=DATASET_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, user=None):
+        #"""Get a cached dataset entry, mark it as recently used and register its user"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if user is not None:
+                    entry["users"].add(user)
+            return entry
+
+    def put(self, key, df, user=None):
+        #"""Cache a parsed frame read-only with its dtypes, evicting idle least recently used entries"""
+        entry = {
+            "df": freeze_frame(df),
+            "dtypes": {col: str(df[col].dtype) for col in df.columns},
+            "nbytes": int(df.memory_usage(deep=True).sum()),
+            # Sessions holding a view, dropped when their processor is garbage collected
+            "users": weakref.WeakSet()
+        }
+        if user is not None:
+            entry["users"].add(user)
+        if entry["nbytes"] > self.max_bytes:
+            return entry
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)["nbytes"]
+            self.entries[key] = entry
+            self.total_bytes += entry["nbytes"]
+            self._evict()
+        return entry
+
+    def release(self, key, user):
+        #"""Unregister a user of a dataset, idle datasets become evictable"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["users"].discard(user)
+            self._evict()
+
+    def _evict(self):
+        #"""Drop idle datasets, least recently used first, until the budget holds (called with the lock held)"""
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if not self.entries[key]["users"]:
+                self.total_bytes -= self.entries.pop(key)["nbytes"]
+
+    def stats(self):
+        #"""Datasets, their memory and the sessions using them"""
+        with self.lock:
+            users = set()
+            for entry in self.entries.values():
+                users.update(id(user) for user in entry["users"])
+            return {"datasets": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes,
+                    "in_use": sum(1 for entry in self.entries.values() if entry["users"]), "sessions": len(users)}
+
+    def clear(self):
+        #"""Drop all cached datasets"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+@st.cache_resource
+def get_dataset_cache():
+    #"""Dataset store shared by all sessions of this server process"""
+    return DatasetCache()
+
+# Process-wide cache of query results keyed by dataset and canonical configuration,
+# LRU evicted by memory size, evicted results optionally spilled to disk.
+# Only files this cache wrote itself are read back.
+
+class ResultCache:
+    def __init__(self, max_bytes=1024 ** 3, spill_dir=None, spill_max_bytes=8 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.total_bytes = 0
+        self.spilled_bytes = 0
+        self.entries = OrderedDict()
+        # Spilled results: key -> (path, size on disk)
+        self.spilled = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def spill_path(self, key):
+        #"""File of a spilled result"""
+        return os.path.join(self.spill_dir, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + ".pkl")
+
+    def get(self, key):
+        #"""Cached result of a key and mark it as recently used, a spilled result is read back, None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry["result"]
+            spilled = self.spilled.pop(key, None)
+            if spilled is None:
+                self.misses += 1
+                return None
+            self.spilled_bytes -= spilled[1]
+        try:
+            with open(spilled[0], 'rb') as handle:
+                result = pickle.load(handle)
+        except Exception:
+            with self.lock:
+                self.misses += 1
+            return None
+        finally:
+            if os.path.exists(spilled[0]):
+                os.remove(spilled[0])
+        with self.lock:
+            self.hits += 1
+        self.put(key, result)
+        return result
+
+    def put(self, key, result):
+        #"""Cache a LazyResult, evicting least recently used entries to the spill directory or dropping them"""
+        nbytes = estimate_bytes(result.df)
+        if nbytes > self.max_bytes:
+            return
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)["nbytes"]
+            self.entries[key] = {"result": result, "nbytes": nbytes}
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                evicted_key, entry = self.entries.popitem(last=False)
+                self.total_bytes -= entry["nbytes"]
+                evicted.append((evicted_key, entry["result"]))
+        if self.spill_dir is not None:
+            for evicted_key, evicted_result in evicted:
+                self.spill(evicted_key, evicted_result)
+
+    def spill(self, key, result):
+        #"""Write an evicted result to disk, dropping the oldest spilled results over the disk budget"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = self.spill_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as handle:
+                pickle.dump(result, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        dropped = []
+        with self.lock:
+            if key in self.spilled:
+                self.spilled_bytes -= self.spilled.pop(key)[1]
+            self.spilled[key] = (path, os.path.getsize(path))
+            self.spilled_bytes += self.spilled[key][1]
+            while self.spilled_bytes > self.spill_max_bytes:
+                _, (old_path, size) = self.spilled.popitem(last=False)
+                self.spilled_bytes -= size
+                dropped.append(old_path)
+        for old_path in dropped:
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def clear(self):
+        #"""Drop all cached results, spilled files included"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            paths = [path for path, _ in self.spilled.values()]
+            self.spilled.clear()
+            self.spilled_bytes = 0
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+@st.cache_resource
+def get_result_cache():
+    #"""Result cache shared by all sessions of this server process"""
+    return ResultCache()
+
+# Multi-core partitioned execution: worker processes memory-map an Arrow copy of the dataset
+PARALLEL_MIN_ROWS = 100000
+
+def run_partition(task):
+    #"""Filter one row range of the shared dataset, then sort it or aggregate it partially"""
+    table = feather.read_table(task['path'], columns=task['columns'], memory_map=True)
+    df = table.slice(task['start'], task['stop'] - task['start']).to_pandas()
+    # Row labels are the global row positions
+    df.index = pd.RangeIndex(task['start'], task['stop'])
+    mask = fused_filter_mask(df, task['filters'])
+    if mask is not None:
+        df = df[mask]
+    if task['grouping'] is not None:
+        group_columns, agg_config = task['grouping']
+        return partial_aggregate(df, group_columns, agg_config)
+    if task['sort'] is not None:
+        sort_columns, ascending = task['sort']
+        return df[sort_columns].sort_values(by=sort_columns, ascending=ascending, kind='mergesort')
+    return df.index.to_numpy()
+
+def importable(function):
+    #"""Same function of the importable module, so that it pickles when the app runs as a script"""
+    module_name = os.path.splitext(os.path.basename(__file__))[0]
+    return getattr(importlib.import_module(module_name), function.__name__)
+
+def partition_worker():
+    #"""run_partition of the importable module"""
+    return importable(run_partition)
+
+@st.cache_resource
+def get_worker_pool(workers):
+    #"""Process pool shared by all sessions, one per worker count"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+# Arrow copies of loaded frames for the worker processes: one file per dataset, shared by every processor
+# that loaded it and removed once the last of them releases it or is garbage collected
+class SharedTables:
+    def __init__(self, shared_dir):
+        self.shared_dir = shared_dir
+        self.entries = {}
+        # Reentrant: a finalizer may run during garbage collection triggered with the lock held
+        self.lock = threading.RLock()
+
+    def acquire(self, key, df, user):
+        #"""Path of the Arrow file of a dataset, written by its first user"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                cache = ColumnarCache(self.shared_dir)
+                name = f"{os.getpid()}-{key}"
+                if not cache.store(name, df):
+                    raise ValueError("dataset cannot be shared with worker processes")
+                entry = self.entries[key] = {"path": cache.path(name), "users": {}}
+            if id(user) not in entry["users"]:
+                entry["users"][id(user)] = weakref.finalize(user, self._drop, key, id(user))
+            return entry["path"]
+
+    def release(self, key, user):
+        #"""Unregister a user of a dataset, the file of an unused dataset is removed"""
+        with self.lock:
+            entry = self.entries.get(key)
+            finalizer = entry["users"].get(id(user)) if entry is not None else None
+        if finalizer is not None:
+            finalizer()
+
+    def _drop(self, key, user_id):
+        path = None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["users"].pop(user_id, None)
+                if not entry["users"]:
+                    path = self.entries.pop(key)["path"]
+        if path is not None:
+            remove_file(path)
+
+    def stats(self):
+        #"""Shared files and their users"""
+        with self.lock:
+            return {"files": len(self.entries), "users": sum(len(entry["users"]) for entry in self.entries.values())}
+
+@st.cache_resource
+def get_shared_tables():
+    #"""Shared Arrow files of this server process"""
+    return SharedTables(private_temp_dir("shared"))
+
+# Default directory of the on-disk columnar cache
+COLUMNAR_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "csv_data_retrieval")
+
+# On-disk columnar cache: parsed datasets persisted as uncompressed Arrow files
+class ColumnarCache:
+    def __init__(self, cache_dir=COLUMNAR_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        #"""Path of the Arrow file of a dataset fingerprint"""
+        return os.path.join(self.cache_dir, f"{key}.arrow")
+
+    def open(self, key):
+        #"""Memory-map a cached dataset, None when it is not cached"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        return feather.read_table(path, memory_map=True)
+
+    def store(self, key, df):
+        #"""Persist a parsed frame, returns False when it cannot be converted"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            # Uncompressed so that reopening is a zero-copy memory map
+            feather.write_feather(df, temp_path, compression='uncompressed')
+            os.replace(temp_path, path)
+            return True
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+# Partitioned datasets: CSV, Arrow and Parquet files queried as one table. Zone maps (per-column kind,
+# min, max and null count of every file and block) let filters skip whole files and blocks unread
+ZONE_MAP_DIR = os.path.join(COLUMNAR_CACHE_DIR, "zone_maps")
+PARTITION_FORMATS = {
+    ".csv": "csv",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".parquet": "parquet"
+}
+
+def column_zone(series):
+    #"""Zone map entry of a column, values of other kinds make it opaque: only its null count is used"""
+    nulls = int(series.isna().sum())
+    values = series.dropna()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values = values.astype(object)
+    if len(values) == 0:
+        return {"kind": None, "min": None, "max": None, "nulls": nulls}
+    kind = None
+    if is_numeric_column(values):
+        kind = "number"
+    elif is_date_column(values):
+        kind = "date"
+    elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) == "string":
+        kind = "string"
+    if kind is None:
+        return {"kind": None, "min": None, "max": None, "nulls": nulls, "opaque": True}
+    low, high = values.min(), values.max()
+    if kind == "number":
+        low, high = float(low), float(high)
+    elif kind == "date":
+        low, high = low.isoformat(), high.isoformat()
+    return {"kind": kind, "min": low, "max": high, "nulls": nulls}
+
+def merge_zones(zones):
+    #"""Zone map entry of several blocks, a column whose kind differs between blocks is opaque"""
+    nulls = sum(zone['nulls'] for zone in zones)
+    valued = [zone for zone in zones if zone['min'] is not None]
+    if any(zone.get('opaque') for zone in zones) or len({zone['kind'] for zone in valued}) > 1:
+        return {"kind": None, "min": None, "max": None, "nulls": nulls, "opaque": True}
+    if not valued:
+        return {"kind": None, "min": None, "max": None, "nulls": nulls}
+    return {"kind": valued[0]['kind'], "min": min(zone['min'] for zone in valued),
+            "max": max(zone['max'] for zone in valued), "nulls": nulls}
+
+def zone_excludes(zone, rows, filter_rule):
+    #"""True when no row of a block can match the rule, following the semantics of build_series_mask"""
+    if zone is None:
+        return False
+    operator, value = filter_rule['operator'], filter_rule['value']
+    if operator == 'isnull':
+        return zone['nulls'] == 0
+    if operator == 'notnull':
+        return zone['nulls'] == rows
+    if operator not in ('eq', 'in', 'gt', 'ge', 'lt', 'le') or zone.get('opaque'):
+        return False
+    if zone['min'] is None:
+        # Only missing values, which never compare equal or ordered
+        return True
+    low, high = zone['min'], zone['max']
+    if zone['kind'] == "number":
+        # 'in' values of numeric columns are compared as text
+        if operator == 'in':
+            return False
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+    elif not isinstance(value, str):
+        return False
+    elif zone['kind'] == "date":
+        low, high = pd.Timestamp(low), pd.Timestamp(high)
+        if operator == 'in':
+            values = [canonical_date(v.strip()) for v in value.split(',')]
+            return all(date < low or date > high for date in values if date is not None)
+        value = canonical_date(value)
+        if value is None:
+            return False
+    elif operator == 'in':
+        return all(v < low or v > high for v in (v.strip() for v in value.split(',')))
+    if operator == 'eq':
+        return value < low or value > high
+    if operator == 'gt':
+        return high <= value
+    if operator == 'ge':
+        return high < value
+    if operator == 'lt':
+        return low >= value
+    return low > value
+
+def parquet_zone(statistics, field, rows):
+    #"""Zone map entry of a Parquet column chunk from its footer statistics, None without statistics"""
+    if statistics is None or not statistics.has_null_count:
+        return None
+    nulls = int(statistics.null_count)
+    kind = None
+    if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+        kind = "number"
+    elif pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+        kind = "string"
+    elif pa.types.is_timestamp(field.type) and field.type.tz is None:
+        kind = "date"
+    if nulls == rows:
+        return {"kind": None, "min": None, "max": None, "nulls": nulls}
+    if kind is None or not statistics.has_min_max:
+        return {"kind": None, "min": None, "max": None, "nulls": nulls, "opaque": True}
+    low, high = statistics.min, statistics.max
+    if kind == "number":
+        low, high = float(low), float(high)
+    elif kind == "date":
+        low, high = pd.Timestamp(low).isoformat(), pd.Timestamp(high).isoformat()
+    return {"kind": kind, "min": low, "max": high, "nulls": nulls}
+
+class PartitionedDataset:
+    def __init__(self, paths, encoding="utf-8", chunk_size=DEFAULT_CHUNK_SIZE, zone_dir=ZONE_MAP_DIR):
+        self.encoding = encoding
+        # Rows per block of CSV files, Arrow record batches and Parquet row groups are the blocks of the others
+        self.chunk_size = chunk_size
+        self.zone_dir = zone_dir
+        self.files = [self.register(path) for path in paths]
+    
+    @property
+    def rows(self):
+        return sum(entry['rows'] for entry in self.files)
+    
+    @property
+    def blocks(self):
+        return sum(len(entry['blocks']) for entry in self.files)
+    
+    def identity(self):
+        #"""Paths, sizes and modification times of the files, unchanged files keep their zone maps"""
+        return [(entry['path'], entry['size'], entry['mtime']) for entry in self.files]
+    
+    def fingerprint(self):
+        #"""Dataset cache key of the registered files"""
+        text = json.dumps([self.identity(), self.chunk_size, self.encoding])
+        return f"{self.rows}-{hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()}"
+    
+    def register(self, path):
+        #"""Zone maps of one file, read from the zone map directory or computed and saved there"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in PARTITION_FORMATS:
+            raise ValueError(f"Unsupported partition file: {path}")
+        stat = os.stat(path)
+        entry = {"path": os.path.abspath(path), "format": PARTITION_FORMATS[extension], "size": stat.st_size, "mtime": stat.st_mtime_ns}
+        key = json.dumps([entry['path'], entry['size'], entry['mtime'], self.chunk_size, self.encoding])
+        zone_path = os.path.join(self.zone_dir, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + ".json")
+        if os.path.exists(zone_path):
+            with open(zone_path, encoding='utf-8') as handle:
+                return json.load(handle)
+        
+        if entry['format'] == "parquet":
+            blocks = self.parquet_blocks(entry['path'])
+        else:
+            blocks = [{"rows": len(frame), "columns": {col: column_zone(frame[col]) for col in frame.columns}}
+                      for frame in self.read_blocks(entry)]
+        entry['rows'] = sum(block['rows'] for block in blocks)
+        entry['blocks'] = blocks
+        columns = list(dict.fromkeys(col for block in blocks for col in block['columns']))
+        entry['columns'] = {col: merge_zones([block['columns'][col] for block in blocks]) for col in columns
+                            if all(block['columns'].get(col) is not None for block in blocks)}
+        
+        os.makedirs(self.zone_dir, exist_ok=True)
+        temp_path = f"{zone_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as handle:
+            json.dump(entry, handle)
+        os.replace(temp_path, zone_path)
+        return entry
+    
+    def parquet_blocks(self, path):
+        #"""Zone maps of the row groups of a Parquet file, from its footer only"""
+        metadata = pq.ParquetFile(path).metadata
+        schema = metadata.schema.to_arrow_schema()
+        blocks = []
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            columns = {}
+            for j in range(row_group.num_columns):
+                chunk = row_group.column(j)
+                # Top-level columns only
+                if chunk.path_in_schema in schema.names:
+                    field = schema.field(chunk.path_in_schema)
+                    columns[field.name] = parquet_zone(chunk.statistics, field, row_group.num_rows)
+            blocks.append({"rows": row_group.num_rows, "columns": columns})
+        return blocks
+    
+    def read_blocks(self, entry, columns=None, keep=None):
+        #"""Frames of the blocks of a file, blocks not in keep are skipped (CSV blocks are still parsed)"""
+        if entry['format'] == "csv":
+            reader = PandasParser(self.encoding).read_chunks(entry['path'], self.chunk_size, columns)
+            for i, frame in enumerate(reader):
+                if keep is None or i in keep:
+                    yield frame
+        elif entry['format'] == "arrow":
+            table = feather.read_table(entry['path'], columns=columns, memory_map=True)
+            for i, batch in enumerate(table.to_batches()):
+                if keep is None or i in keep:
+                    yield batch.to_pandas()
+        else:
+            parquet = pq.ParquetFile(entry['path'])
+            for i in range(parquet.num_row_groups):
+                if keep is None or i in keep:
+                    yield parquet.read_row_group(i, columns=columns).to_pandas()
+    
+    def head(self, rows):
+        #"""First rows of the first file"""
+        entry = self.files[0]
+        if entry['format'] == "csv":
+            return PandasParser(self.encoding).read(entry['path'], nrows=rows)
+        return next(self.read_blocks(entry), pd.DataFrame()).iloc[:rows]
+    
+    def prune(self, filters):
+        #"""Files and blocks the conjunctive rules may match, as [(file entry, block positions)]"""
+        selected = []
+        for entry in self.files:
+            if any(zone_excludes(entry['columns'].get(rule['column']), entry['rows'], rule) for rule in filters):
+                continue
+            keep = [i for i, block in enumerate(entry['blocks'])
+                    if not any(zone_excludes(block['columns'].get(rule['column']), block['rows'], rule) for rule in filters)]
+            if keep:
+                selected.append((entry, keep))
+        return selected
+    
+    def scan(self, selected, columns=None):
+        #"""Frames of the selected blocks with the fraction of their rows read so far"""
+        total = sum(entry['blocks'][i]['rows'] for entry, keep in selected for i in keep)
+        done = 0
+        for entry, keep in selected:
+            for frame in self.read_blocks(entry, columns, set(keep)):
+                done += len(frame)
+                yield frame, done / total if total else None
+
+# Follow mode: a growing CSV is read from the byte offset where the previous run stopped, the filtered rows
+# and the mergeable group aggregate state of the configuration are kept and extended with the new rows
+FOLLOW_BLOCK_BYTES = 64 << 20
+
+def read_header(path):
+    #"""Header line of a CSV file as bytes, None until it is complete"""
+    with open(path, 'rb') as handle:
+        line = handle.readline()
+    return line if line.endswith(b'\n') else None
+
+def read_appended(path, offset, header, chunk_size, columns=None, encoding="utf-8"):
+    #"""Frames of the complete lines from a byte offset on, with the offset after their block, a partial last line is left unread"""
+    with open(path, 'rb') as handle:
+        handle.seek(offset)
+        pending = b""
+        while True:
+            block = handle.read(FOLLOW_BLOCK_BYTES)
+            if not block:
+                break
+            data = pending + block
+            cut = data.rfind(b'\n') + 1
+            pending = data[cut:]
+            if cut == 0:
+                continue
+            offset += cut
+            # Each block is parsed on its own, records must not contain quoted line breaks
+            for frame in pd.read_csv(io.BytesIO(header + data[:cut]), chunksize=chunk_size, usecols=columns, encoding=encoding):
+                yield frame, offset
+
+class FollowState:
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.reset(None, None)
+    
+    def reset(self, key, inode):
+        #"""Start over from the first row, for a new configuration or a replaced / truncated file"""
+        # Canonical configuration the kept results belong to
+        self.key = key
+        self.inode = inode
+        self.header = None
+        self.offset = 0
+        self.rows = 0
+        # Merged group aggregate state, or the filtered rows without grouping
+        self.state = None
+        self.matched = None
+
+# Memory governor: the peak of an in-memory query is estimated from column widths and row counts and checked against
+# the headroom of a process memory budget above the resident datasets, queries over it run in chunks of the loaded
+# data and write their rows to a disk-backed result
+QUERY_MEMORY_BUDGET = int(os.environ.get("CSV_FILTER_MEMORY_BUDGET_MB", 0)) << 20
+# Share of the headroom one chunk, or the merge buffers of a chunked sort, may take
+GOVERNOR_CHUNK_SHARE = 0.25
+GOVERNOR_MIN_CHUNK_ROWS = 10000
+GOVERNOR_MIN_BLOCK_ROWS = 1000
+
+def column_widths(df, sample_rows=1000):
+    #"""Estimated bytes per row of each column, string contents measured on evenly spaced rows"""
+    sample = df if len(df) <= sample_rows else df.iloc[::len(df) // sample_rows]
+    usage = sample.memory_usage(deep=True, index=False)
+    return {col: float(usage[col]) / max(len(sample), 1) for col in df.columns}
+
+def format_mb(nbytes):
+    return f"{nbytes / 1024 ** 2:,.0f} MB"
+
+# Streaming export: results are serialized chunk by chunk into a file on disk
+EXPORT_CHUNK_ROWS = 100000
+# Format: (file extension, mime type)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "JSON": ("json", "application/json"),
+    "NDJSON": ("ndjson", "application/x-ndjson"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet")
+}
+# Compression: (file suffix, mime type), Parquet compresses its pages instead
+EXPORT_COMPRESSION = {
+    "none": ("", None),
+    "gzip": (".gz", "application/gzip"),
+    "zstd": (".zst", "application/zstd")
+}
+
+def open_export_stream(path, compression):
+    #"""Open a binary output file, compressed on the fly"""
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    if compression == 'zstd':
+        if pa is None:
+            raise ValueError("zstd compression requires pyarrow")
+        return pa.CompressedOutputStream(path, 'zstd')
+    return open(path, 'wb')
+
+def export_chunks(data, chunk_rows):
+    #"""Chunks of rows of a frame, or the blocks of a disk-backed result, at least one chunk"""
+    if isinstance(data, SpilledResult):
+        yield data.template
+        yield from data.blocks()
+        return
+    for start in range(0, max(len(data), 1), chunk_rows):
+        yield data.iloc[start:start + chunk_rows]
+
+def write_export(df, path, export_format, compression="none", chunk_rows=EXPORT_CHUNK_ROWS):
+    #"""Write a frame or a disk-backed result as CSV / JSON / NDJSON / Parquet, one chunk of rows in memory at a time"""
+    if export_format == "Parquet":
+        if pa is None:
+            raise ValueError("Parquet export requires pyarrow")
+        # Schema of the whole frame, so that chunks with only missing values keep the column types
+        schema = pa.Schema.from_pandas(df.schema_frame() if isinstance(df, SpilledResult) else df, preserve_index=False)
+        codec = compression if compression != "none" else None
+        with pq.ParquetWriter(path, schema, compression=codec) as writer:
+            for chunk in export_chunks(df, chunk_rows):
+                if len(chunk):
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        return path
+    
+    with open_export_stream(path, compression) as out:
+        if export_format == "JSON":
+            out.write(b"[")
+        header = True
+        records = False
+        for chunk in export_chunks(df, chunk_rows):
+            chunk = dates_as_text(chunk)
+            if export_format == "CSV":
+                if header or len(chunk):
+                    out.write(chunk.to_csv(index=False, header=header).encode('utf-8'))
+                    header = False
+            elif export_format == "NDJSON":
+                if len(chunk):
+                    out.write(chunk.to_json(orient='records', lines=True).encode('utf-8'))
+            elif export_format == "JSON":
+                if len(chunk):
+                    # Records of each chunk without the enclosing brackets
+                    if records:
+                        out.write(b",")
+                    out.write(chunk.to_json(orient='records')[1:-1].encode('utf-8'))
+                    records = True
+            else:
+                raise ValueError(f"Unsupported export format: {export_format}")
+        if export_format == "JSON":
+            out.write(b"]")
+    return path
+
+# Background query execution: the worker thread reports progress and checks for cancellation
+QUERY_THREADS = 4
+
+class QueryCancelled(Exception):
+    pass
+
+class QueryJob:
+    def __init__(self, processor, total_rows=None):
+        # Snapshot of the processor that runs the query, the session keeps editing its own
+        self.processor = processor
+        self.total_rows = total_rows
+        self.stage = "queued"
+        self.rows = 0
+        self.fraction = 0.0
+        self.started = time.time()
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.collected = False
+    
+    def update(self, stage, rows=None, fraction=None):
+        #"""Progress checkpoint of the worker thread, raises QueryCancelled once cancellation is requested"""
+        if self.cancel_event.is_set():
+            raise QueryCancelled()
+        self.stage = stage
+        if rows is not None:
+            self.rows = rows
+        if fraction is not None:
+            self.fraction = min(max(fraction, 0.0), 1.0)
+    
+    def cancel(self):
+        #"""Request cancellation, the query stops at its next checkpoint"""
+        self.cancel_event.set()
+    
+    def done(self):
+        return self.future is not None and self.future.done()
+    
+    def outcome(self):
+        #"""(success, message) of a finished job"""
+        return self.future.result()
+    
+    def elapsed(self):
+        return time.time() - self.started
+
+@st.cache_resource
+def get_query_executor():
+    #"""Thread pool running the queries of all sessions"""
+    return ThreadPoolExecutor(max_workers=QUERY_THREADS, thread_name_prefix="query")
+
 # the class of Main application processing 
 class CSVDataProcessor:
     def __init__(self):
@@ -107,17 +1951,298 @@ class CSVDataProcessor:
             "grouping": None,
             "aggregations": []
         }
-        self.processed_df = None
+        self.result = None
         self.config_history = []
+        # Streaming mode: the source is re-read in chunks, self.df only holds a sample
+        self.source = None
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.sample_rows = 1000
+        # Parse-once dataset store shared across reruns and sessions (set by the UI), self.df is a view of its shared_key entry
+        self.dataset_cache = None
+        self.shared_key = None
+        self.fingerprint = None
+        # Query results of (dataset, canonical configuration), shared across sessions (set by the UI)
+        self.result_cache = None
+        self.upload_identity = None
+        # Optional on-disk columnar cache, self.columnar is the memory-mapped table
+        self.columnar_cache = None
+        self.columnar = None
+        # Partitioned dataset of several files, self.df only holds the first rows of the first file,
+        # zone maps let queries skip the files and blocks their filters rule out
+        self.dataset = None
+        self.use_zone_maps = True
+        # Follow mode of a growing server-side CSV, self.df only holds its first rows
+        self.follow = None
+        # Lazily built column indexes of self.df, reused across queries
+        self.use_indexes = False
+        self.indexes = {}
+        self.indexed_df = None
+        # Dictionary encodings of string columns used by contains / regex rules
+        self.dictionary_encode = True
+        self.encodings = {}
+        # Stage results of earlier queries on self.df: row positions per set of filter rules,
+        # and the last selected frame as (rule set, columns, frame)
+        self.reuse_stages = True
+        self.filter_states = OrderedDict()
+        self.selection_state = None
+        # Rollups of groupings used repeatedly in query_history: keys -> {"measures", "state"}, None once rejected as too large
+        self.use_rollups = True
+        self.rollups = OrderedDict()
+        # Configurations of the executed grouped queries, most recent last
+        self.query_history = []
+        # Load-time dtype optimization, the schema profile lets repeat loads skip inference
+        self.optimize_dtypes = False
+        self.schema = None
+        self.load_note = ""
+        # Worker processes for partitioned execution, 1 runs on the calling thread
+        self.workers = 1
+        self.shared_table = None
+        self.shared_path = None
+        self.shared_df = None
+        # Last export file on disk, replaced by the next export
+        self.export_path = None
+        # Per-stage profile of the last run, memory tracing and logging are opt-in
+        self.profile = True
+        self.profile_memory = False
+        self.log_profile = False
+        self.profiler = None
+        self.last_profile = None
+        # Background job this processor reports progress to
+        self.job = None
+        # Memory governor: process budget in bytes (0 = unlimited) and the decision of the last run
+        self.memory_budget = QUERY_MEMORY_BUDGET
+        self.memory_decision = None
+        # CSV parser backend: "auto" picks the multithreaded Arrow reader when pyarrow is installed
+        self.parser_backend = "auto"
+        self.parse_threads = None
+        self.block_size = ARROW_BLOCK_SIZE
+        self.encoding = "utf-8"
+        # Sampled preview: reservoir sample of the loaded data (drawn on first use) and the last preview result
+        self.preview_rows = PREVIEW_SAMPLE_ROWS
+        self.reservoir = None
+        self.preview = None
+        self.preview_state = None
+        self.preview_message = None
     
-    def load_csv(self, file):
+    def load_csv(self, file, streaming=False):
         #"""Load CSV file"""
         try:
-            self.df = pd.read_csv(file)
-            return True, f"Successfully loaded CSV file, with {len (self. df)} rows and {len (self. df. columns)} columns"
+            if streaming:
+                # Same upload as the previous rerun: the source, its reservoir sample and fingerprint stay valid
+                identity = self._upload_identity(file)
+                if identity is not None and identity == self.upload_identity and self.source is not None:
+                    return True, f"Streaming mode: detected {len (self. df. columns)} columns, data will be processed in chunks of {self.chunk_size} rows"
+                # The fingerprint of the same upload loaded in memory before still holds
+                fingerprint = self.fingerprint if identity is not None and identity == self.upload_identity else None
+                self._reset_source()
+                self.source = file
+                self.reservoir = None
+                # Otherwise computed by the first query that looks up the result cache
+                self.fingerprint = fingerprint
+                self.upload_identity = identity
+                self.df = self.parser().read(self._rewind_source(), nrows=self.sample_rows)
+                self._rewind_source()
+                return True, f"Streaming mode: detected {len (self. df. columns)} columns, data will be processed in chunks of {self.chunk_size} rows"
+            if self.dataset_cache is None and self.columnar_cache is None:
+                self._reset_source()
+                self.reservoir = None
+                self.fingerprint = None
+                self.df = self.parse_csv(file)
+                return True, f"Successfully loaded CSV file, with {len (self. df)} rows and {len (self. df. columns)} columns{self.load_note}"
+            
+            # Same upload as the previous rerun: nothing to do, the columnar table stays open
+            identity = self._upload_identity(file)
+            if identity is not None and identity == self.upload_identity and self.df is not None and self.source is None:
+                rows = self.columnar.num_rows if self.columnar is not None else len(self.df)
+                return True, f"Successfully loaded CSV file, with {rows} rows and {len (self. df. columns)} columns"
+            
+            if identity is None or identity != self.upload_identity or self.fingerprint is None:
+                self.fingerprint = fingerprint_file(file)
+            self._reset_source()
+            self.upload_identity = identity
+            self.reservoir = None
+            entry = self.dataset_cache.get(self.cache_key(), self) if self.dataset_cache is not None else None
+            if entry is not None:
+                # Zero-copy view of the shared read-only frame
+                self.df = entry["df"].copy(deep=False)
+                self.shared_key = self.cache_key()
+                return True, f"Successfully loaded CSV file (from cache), with {len (self. df)} rows and {len (self. df. columns)} columns"
+            
+            # Reopen the persisted columnar copy instead of parsing the text again
+            table = self.columnar_cache.open(self.cache_key()) if self.columnar_cache is not None else None
+            if table is not None:
+                self.columnar = table
+                self.df = table.slice(0, self.sample_rows).to_pandas()
+                return True, f"Successfully opened columnar cache (memory-mapped), with {table.num_rows} rows and {table.num_columns} columns"
+            
+            self.df = self.parse_csv(file)
+            if self.dataset_cache is not None:
+                self.df = self.dataset_cache.put(self.cache_key(), self.df, self)["df"].copy(deep=False)
+                self.shared_key = self.cache_key()
+            if self.columnar_cache is not None:
+                self.columnar_cache.store(self.cache_key(), self.df)
+            return True, f"Successfully loaded CSV file, with {len (self. df)} rows and {len (self. df. columns)} columns{self.load_note}"
         except Exception as e:
             return False, f"Failed to load CSV file: {str (e)}"
     
+    def load_dataset(self, paths):
+        #"""Register CSV / Arrow / Parquet files as one partitioned dataset, queries read only the blocks they need"""
+        try:
+            if not paths:
+                return False, "No partition files to load"
+            dataset = PartitionedDataset(paths, self.encoding, self.chunk_size)
+            # Same files as the previous rerun: nothing to do
+            if self.dataset is not None and self.dataset.identity() == dataset.identity() and self.dataset.chunk_size == dataset.chunk_size:
+                return True, f"Partitioned dataset of {len(dataset.files)} files, {dataset.rows} rows in {dataset.blocks} blocks"
+            self._reset_source()
+            self.df = dataset.head(self.sample_rows)
+            self.dataset = dataset
+            self.reservoir = None
+            self.upload_identity = None
+            self.fingerprint = dataset.fingerprint()
+            return True, f"Registered a partitioned dataset of {len(dataset.files)} files, {dataset.rows} rows in {dataset.blocks} blocks"
+        except Exception as e:
+            return False, f"Failed to load partitioned dataset: {str (e)}"
+    
+    def follow_csv(self, path):
+        #"""Follow a growing server-side CSV, each run only reads the rows appended since the previous one"""
+        try:
+            if self.follow is not None and self.follow.path == os.path.abspath(path) and self.df is not None:
+                return True, f"Following {path}: {self.follow.rows} rows read up to byte {self.follow.offset}"
+            self._reset_source()
+            self.df = PandasParser(self.encoding).read(path, nrows=self.sample_rows)
+            self.follow = FollowState(path)
+            self.reservoir = None
+            self.fingerprint = None
+            self.upload_identity = None
+            return True, f"Follow mode: detected {len (self. df. columns)} columns, each run reads only the rows appended to {path}"
+        except Exception as e:
+            return False, f"Failed to follow CSV file: {str (e)}"
+    
+    def _reset_source(self):
+        #"""Forget the previous data source, releasing its dataset in the shared store"""
+        if self.shared_key is not None and self.dataset_cache is not None:
+            self.dataset_cache.release(self.shared_key, self)
+        self.shared_key = None
+        self.release_shared_table()
+        self.source = None
+        self.columnar = None
+        self.dataset = None
+        self.follow = None
+    
+    def parser(self):
+        #"""Parser backend of the current options"""
+        backend = self.parser_backend
+        if backend == "auto":
+            backend = "pyarrow" if pa is not None else "pandas"
+        if backend == "pyarrow":
+            if pa is None:
+                raise ValueError("The pyarrow parser requires pyarrow to be installed")
+            return ArrowParser(self.encoding, self.block_size, self.parse_threads)
+        return PARSER_BACKENDS[backend](self.encoding)
+    
+    def read_table(self, file, dtype=None):
+        #"""Parse with the selected backend, pandas takes over files the Arrow reader rejects or would parse differently"""
+        parser = self.parser()
+        try:
+            return parser.read(file, dtype=dtype)
+        except Exception as e:
+            if parser.name == "pandas" or not isinstance(e, (pa.ArrowException, ParserMismatch)):
+                raise
+            # e.g. a column whose type changes after the first block, or 20-digit identifiers
+            self.load_note += f", parsed with pandas ({parser.name}: {str(e).splitlines()[0]})"
+            return PandasParser(self.encoding).read(rewind(file), dtype=dtype)
+    
+    def parse_csv(self, file):
+        #"""Parse the whole CSV, optimizing column types when enabled"""
+        self.load_note = ""
+        if not self.optimize_dtypes:
+            return self.read_table(file)
+        
+        # A matching schema profile replaces type inference
+        if self.schema:
+            try:
+                header = list(self.parser().read(rewind(file), nrows=0).columns)
+                if header == list(self.schema):
+                    df = read_csv_with_schema(rewind(file), self.schema, self.parser())
+                    self.load_note += f", schema profile applied ({memory_bytes(df) / 1024 ** 2:.1f} MB)"
+                    return df
+            except Exception:
+                pass
+            rewind(file)
+        
+        df = self.read_table(file)
+        before = memory_bytes(df)
+        self.schema = optimize_dtypes(df)
+        after = memory_bytes(df)
+        self.load_note += f", memory {before / 1024 ** 2:.1f} MB -> {after / 1024 ** 2:.1f} MB (saved {1 - after / max(before, 1):.0%})"
+        return df
+    
+    def cache_key(self):
+        #"""Cache key of the loaded dataset, parsed frames differ with dtype optimization"""
+        key = f"{self.fingerprint}-opt" if self.optimize_dtypes else self.fingerprint
+        return key if self.encoding == "utf-8" else f"{key}-{self.encoding}"
+    
+    def canonical_config(self):
+        #"""Configuration text that ignores filter order, repeated rules and value spellings the filters treat alike"""
+        config = self.config
+        grouping = config.get('grouping') or {}
+        grouped = bool(grouping.get('enabled'))
+        filters = {}
+        for rule in config.get('filters') or []:
+            canonical = self.canonical_rule(rule)
+            filters[json.dumps(canonical, default=str)] = canonical
+        canonical = {
+            "selected_columns": list(config.get('selected_columns') or []),
+            # Conjunctive rules commute
+            "filters": [filters[text] for text in sorted(filters)],
+            # Group aggregation output is ordered by the group keys, sorting rules do not apply
+            "sorting": [] if grouped else [[rule['column'], bool(rule['ascending'])] for rule in config.get('sorting') or []],
+            "grouping": list(grouping.get('columns') or []) if grouped else None,
+            "aggregations": [[agg['column'], agg['function']] for agg in config.get('aggregations') or []] if grouped else []
+        }
+        return json.dumps(canonical, sort_keys=True, separators=(',', ':'), default=str)
+    
+    def canonical_rule(self, rule):
+        #"""[column, operator, value] of a filter rule, with the value spelled as the filter compares it"""
+        col, operator, value = rule['column'], rule['operator'], rule['value']
+        if operator in ('isnull', 'notnull'):
+            value = ""
+        elif operator == 'in':
+            # Comma separated values are stripped and matched as a set
+            value = ",".join(sorted({v.strip() for v in str(value).split(',')}))
+        elif col in self.df.columns and is_numeric_column(self.df[col]):
+            # Values of numeric columns are compared as numbers, as in convert_filter_value
+            try:
+                value = repr(float(value))
+            except (TypeError, ValueError):
+                pass
+        return [col, operator, value]
+    
+    def result_key(self):
+        #"""Result cache key of the loaded dataset and the current configuration, None without a fingerprint"""
+        if self.fingerprint is None and self.source is not None:
+            self.fingerprint = fingerprint_file(self._rewind_source())
+        if self.fingerprint is None:
+            return None
+        return f"{self.cache_key()}:{self.canonical_config()}"
+    
+    def _upload_identity(self, file):
+        #"""Identity of a Streamlit upload or a server-side file, None for other sources"""
+        if is_path(file):
+            stat = os.stat(file)
+            return (os.path.abspath(file), stat.st_size, stat.st_mtime_ns, self.encoding)
+        file_id = getattr(file, 'file_id', None)
+        if file_id is None:
+            return None
+        return (getattr(file, 'name', None), getattr(file, 'size', None), file_id, self.encoding)
+    
+    def _rewind_source(self):
+        #"""Return the streaming source positioned at its start"""
+        if hasattr(self.source, 'seek'):
+            self.source.seek(0)
+        return self.source
+    
     def get_column_names(self):
         #"""Get column names"""
         return list(self.df.columns) if self.df is not None else []
@@ -133,114 +2258,1168 @@ class CSVDataProcessor:
         self.config = config
         self.config_history.append(config.copy())
     
+    def apply_filters(self, df, filters=None, columns=None):
+        #"""Apply column selection and filtering conditions with one fused mask and a single take"""
+        selected = self.config['selected_columns']
+        if filters is None:
+            filters = self.config['filters']
+        if columns is None and selected:
+            columns = selected
+        
+        # Filters only see the selected columns, as if the selection was applied first
+        if selected:
+            for filter_rule in filters:
+                if filter_rule['column'] not in selected:
+                    raise KeyError(filter_rule['column'])
+        for filter_rule in filters:
+            if filter_rule['column'] not in df.columns:
+                raise KeyError(filter_rule['column'])
+        if columns is not None:
+            missing = [col for col in columns if col not in df.columns]
+            if missing:
+                raise KeyError(missing[0])
+        
+        # Empty frames only validate the rules, they are left out of the profile
+        profiler = self.profiler if len(df) else None
+        self.progress("selection" if not filters else "filtering")
+        
+        # Same rules and columns as an earlier query: its selected frame is the result
+        rule_set = self.rule_set(df, filters)
+        selection = (rule_set, tuple(columns) if columns is not None else None)
+        if rule_set is not None and self.selection_state is not None and self.selection_state[:2] == selection:
+            with profile_stage(profiler, "selection (reused)", len(df)) as entry:
+                entry['rows_out'] = len(self.selection_state[2])
+            return self.selection_state[2]
+        
+        # Positions of earlier rules are narrowed by the new rules, otherwise indexed rules give candidate
+        # positions, the others are evaluated on candidates only
+        positions, filters = self.reused_positions(rule_set, filters, profiler)
+        if positions is None:
+            positions, filters = self.indexed_positions(df, filters)
+        encoded = self.filter_encodings(df, filters)
+        if positions is not None:
+            if filters:
+                candidates = {}
+                for filter_rule in filters:
+                    col = filter_rule['column']
+                    candidates[col] = (encoded[col] if col in encoded else df[col]).iloc[positions]
+                positions = positions[fused_filter_mask(df, filters, candidates, profiler, self.progress)]
+        else:
+            mask = fused_filter_mask(df, filters, encoded, profiler, self.progress)
+            if mask is None:
+                return df[columns] if columns is not None else df
+            positions = np.flatnonzero(mask)
+        with profile_stage(profiler, "selection", len(df)) as entry:
+            if columns is not None:
+                result = df.iloc[positions, df.columns.get_indexer(columns)]
+            else:
+                result = df.iloc[positions]
+            entry['rows_out'] = len(result)
+        if rule_set is not None:
+            self.filter_states[rule_set] = compact_positions(positions)
+            self.filter_states.move_to_end(rule_set)
+            # A selected frame over the budget is not kept, the positions of the oldest rule sets make room for it
+            nbytes = estimate_bytes(result)
+            self.selection_state = selection + (result, nbytes) if nbytes <= STAGE_CACHE_BYTES else None
+            while self.filter_states and (len(self.filter_states) > STAGE_CACHE_ENTRIES
+                                          or self.stage_cache_bytes() > STAGE_CACHE_BYTES):
+                self.filter_states.popitem(last=False)
+        return result
+    
+    def stage_cache_bytes(self):
+        #"""Memory held by the kept filter positions and the last selected frame"""
+        nbytes = sum(positions.nbytes for positions in self.filter_states.values())
+        return nbytes + (self.selection_state[3] if self.selection_state is not None else 0)
+    
+    def rule_set(self, df, filters):
+        #"""Canonical rules of a filter list on self.df, None when its stage results are not kept"""
+        if df is not self.df or not self.reuse_stages or not filters:
+            return None
+        self._check_derived_structures()
+        return frozenset(json.dumps(self.canonical_rule(filter_rule), default=str) for filter_rule in filters)
+    
+    def reused_positions(self, rule_set, filters, profiler=None):
+        #"""Positions of the largest kept rule set included in these rules, returns (positions, remaining rules)"""
+        if rule_set is None:
+            return None, filters
+        best = None
+        for kept in self.filter_states:
+            if kept <= rule_set and (best is None or len(kept) > len(best)):
+                best = kept
+        if best is None:
+            return None, filters
+        self.filter_states.move_to_end(best)
+        positions = self.filter_states[best]
+        with profile_stage(profiler, f"reuse {len(best)} filter rules", len(self.df)) as entry:
+            entry['rows_out'] = len(positions)
+        remaining = [filter_rule for filter_rule in filters
+                     if json.dumps(self.canonical_rule(filter_rule), default=str) not in best]
+        return positions, remaining
+    
+    def dictionary_kind(self, filter_rule):
+        #"""'dictionary' when a string rule can run on a dictionary-encoded column"""
+        if filter_rule['operator'] not in ('contains', 'regex') or filter_rule['column'] not in self.df.columns:
+            return None
+        if isinstance(self.df[filter_rule['column']].dtype, pd.CategoricalDtype):
+            return 'dictionary'
+        if not self.dictionary_encode or self.source is not None or self.columnar is not None or self.dataset is not None or self.follow is not None:
+            return None
+        if self.df[filter_rule['column']].dtype != object or self.encodings.get(filter_rule['column'], True) is None:
+            return None
+        return 'dictionary'
+    
+    def dictionary_encoding(self, col):
+        #"""Dictionary-encoded copy of a low-cardinality string column, None otherwise"""
+        self._check_derived_structures()
+        if col not in self.encodings:
+            series = self.df[col]
+            codes, uniques = pd.factorize(series)
+            encoded = None
+            if len(uniques) <= len(series) * DICTIONARY_MAX_RATIO:
+                encoded = pd.Series(pd.Categorical.from_codes(codes, categories=uniques), index=series.index)
+            self.encodings[col] = encoded
+        return self.encodings[col]
+    
+    def filter_encodings(self, df, filters):
+        #"""Dictionary-encoded columns for the string rules evaluated on self.df"""
+        encoded = {}
+        if df is not self.df:
+            return encoded
+        for filter_rule in filters:
+            col = filter_rule['column']
+            if col not in encoded and self.df[col].dtype == object and self.dictionary_kind(filter_rule):
+                encoding = self.dictionary_encoding(col)
+                if encoding is not None:
+                    encoded[col] = encoding
+        return encoded
+    
+    def _check_derived_structures(self):
+        #"""Drop indexes and encodings built for a previously loaded frame"""
+        if self.indexed_df is not self.df:
+            self.indexes = {}
+            self.encodings = {}
+            self.filter_states = OrderedDict()
+            self.selection_state = None
+            self.rollups = OrderedDict()
+            self.indexed_df = self.df
+    
+    def index_kind(self, filter_rule):
+        #"""Index type usable by a filter rule, None when the column must be scanned"""
+        if not self.use_indexes or self.source is not None or self.columnar is not None or self.dataset is not None or self.follow is not None:
+            return None
+        col = filter_rule['column']
+        if col not in self.df.columns:
+            return None
+        series = self.df[col]
+        if filter_rule['operator'] in ('eq', 'in') and (series.dtype == object or is_numeric_column(series)):
+            return 'hash'
+        if filter_rule['operator'] in ('gt', 'ge', 'lt', 'le') and is_numeric_column(series):
+            return 'sorted'
+        return None
+    
+    def get_index(self, col, kind):
+        #"""Get a column index, building it on first use"""
+        self._check_derived_structures()
+        key = (col, kind)
+        if key not in self.indexes:
+            self.indexes[key] = HashIndex(self.df[col]) if kind == 'hash' else SortedIndex(self.df[col])
+        return self.indexes[key]
+    
+    def index_lookup(self, filter_rule):
+        #"""Sorted row positions matching a rule from its column index, None to scan instead"""
+        kind = self.index_kind(filter_rule)
+        if kind is None:
+            return None
+        col = filter_rule['column']
+        value = convert_filter_value(self.df[col], filter_rule['value'])
+        if kind == 'hash':
+            if filter_rule['operator'] == 'in':
+                return self.get_index(col, kind).lookup([v.strip() for v in value.split(',')])
+            return self.get_index(col, kind).lookup([value])
+        if not isinstance(value, float):
+            return None
+        index = self.get_index(col, kind)
+        lo, hi = index.range_bounds(filter_rule['operator'], value)
+        # Wide ranges are cheaper to scan than to sort their positions
+        if hi - lo > len(self.df) // 4:
+            return None
+        return index.lookup(lo, hi)
+    
+    def indexed_positions(self, df, filters):
+        #"""Intersect the positions of indexed rules, returns (positions, remaining rules)"""
+        if df is not self.df or not self.use_indexes:
+            return None, filters
+        positions = None
+        remaining = []
+        for filter_rule in filters:
+            matched = None
+            if self.index_kind(filter_rule) is not None:
+                with profile_stage(self.profiler, f"index {rule_label(filter_rule)}", len(df)) as entry:
+                    matched = self.index_lookup(filter_rule)
+                    entry['rows_out'] = len(matched) if matched is not None else None
+            if matched is None:
+                remaining.append(filter_rule)
+            elif positions is None:
+                positions = matched
+            else:
+                positions = np.intersect1d(positions, matched, assume_unique=True)
+        if positions is None:
+            return None, filters
+        return positions, remaining
+    
+    def estimate_filters(self):
+        #"""Estimate cost and selectivity of each filter rule on a sample, best ranked first"""
+        sample = self.df
+        if len(sample) > self.sample_rows:
+            sample = sample.iloc[::len(sample) // self.sample_rows]
+        
+        estimates = []
+        for filter_rule in self.config['filters']:
+            cost = FILTER_COSTS.get(filter_rule['operator'], 1)
+            try:
+                if sample[filter_rule['column']].dtype == object:
+                    cost *= 4
+                selectivity = float(mask_to_array(build_filter_mask(sample, filter_rule)).mean()) if len(sample) else 1.0
+            except Exception:
+                # Invalid rules are reported when the plan is executed
+                selectivity = 1.0
+            access = self.index_kind(filter_rule) or self.dictionary_kind(filter_rule)
+            if access == 'dictionary':
+                cost = FILTER_COSTS.get(filter_rule['operator'], 1) // 10
+            estimates.append({"rule": filter_rule, "cost": cost, "selectivity": selectivity, "index": access})
+        
+        # Cheapest cost per removed row first, ties keep configuration order
+        return sorted(estimates, key=lambda e: e["cost"] / max(1.0 - e["selectivity"], 1e-6))
+    
+    def plan_query(self):
+        #"""Build the execution plan of the current configuration"""
+        grouping = bool(self.config['grouping'] and self.config['grouping']['enabled'])
+        if self.source is not None:
+            scan = "csv_chunks"
+        elif self.dataset is not None:
+            scan = "partitions"
+        elif self.follow is not None:
+            scan = "follow"
+        elif self.columnar is not None:
+            scan = "columnar"
+        else:
+            scan = "memory"
+        plan = {
+            "scan": scan,
+            "columns": self.referenced_columns(),
+            "filters": self.estimate_filters(),
+            # Group aggregation output is ordered by the group keys, an earlier sort is wasted work
+            "sort": self.get_sort_spec() if self.config['sorting'] and not grouping else None,
+            "grouping": grouping
+        }
+        # Zone maps rule out files and blocks before anything is read
+        plan["partitions"] = self.dataset.prune(self.config['filters'] if self.use_zone_maps else []) if scan == "partitions" else None
+        plan["rollup"] = self.rollup_plan(plan)
+        rows = self.columnar.num_rows if self.columnar is not None else len(self.df)
+        plan["parallel"] = (self.workers > 1 and pa is not None and scan not in ("csv_chunks", "partitions", "follow") and rows >= PARALLEL_MIN_ROWS
+                            and bool(plan['filters'] or plan['sort'] or grouping) and plan['rollup'] is None)
+        return plan
+    
+    def estimate_groups(self, group_columns):
+        #"""Estimated number of groups, from the planner sample"""
+        sample = self.df
+        if len(sample) > self.sample_rows:
+            sample = sample.iloc[::len(sample) // self.sample_rows]
+        if not len(sample) or any(col not in sample.columns for col in group_columns):
+            return 0
+        groups = sample.groupby(group_columns, observed=True, dropna=False).ngroups
+        rows = self.columnar.num_rows if self.columnar is not None else len(self.df)
+        # Few distinct values in the sample are taken as all of them, otherwise groups grow with the rows
+        return groups if groups <= len(sample) // 2 else rows * groups / len(sample)
+    
+    def estimate_memory(self, plan):
+        #"""Estimated bytes of each stage of the in-memory execution of a plan, their peak and the bytes per row"""
+        rows = self.columnar.num_rows if self.columnar is not None else len(self.df)
+        widths = column_widths(self.df)
+        columns = plan['columns'] if plan['columns'] is not None else list(self.df.columns)
+        row_bytes = sum(widths.get(col, 8.0) for col in columns)
+        matched = rows
+        for estimate in plan['filters']:
+            matched *= estimate['selectivity']
+        stages = {}
+        if plan['scan'] == "columnar":
+            stages['scan'] = rows * row_bytes
+        if plan['filters']:
+            # Fused mask, the mask of one rule and the matching positions
+            stages['filter masks'] = rows * 2 + matched * 8
+        if plan['filters'] or self.config['selected_columns']:
+            stages['selection'] = matched * row_bytes
+        if plan['sort'] is not None:
+            # Rank keys and positions, then the sorted copy made at export
+            stages['sort'] = matched * 8 * (len(plan['sort'][0]) + 1) + matched * row_bytes
+        if plan['grouping']:
+            group_columns = self.config['grouping']['columns']
+            # Group codes of every row, then a hash table entry and the aggregates of every group
+            groups = min(matched, self.estimate_groups(group_columns))
+            stages['group aggregation'] = matched * 8 * (len(group_columns) + 1) + groups * (64 + 8 * len(self.config['aggregations']))
+        peak = (stages.get('scan', 0) + stages.get('filter masks', 0) + stages.get('selection', 0)
+                + max(stages.get('sort', 0), stages.get('group aggregation', 0)))
+        return stages, peak, row_bytes
+    
+    def govern_memory(self, plan):
+        #"""How the plan runs under the memory budget: (rows per chunk or None to run in memory, decision text)"""
+        if not self.memory_budget or plan['scan'] not in ("memory", "columnar") or plan['rollup'] is not None:
+            return None, None
+        stages, peak, row_bytes = self.estimate_memory(plan)
+        resident = self.resident_bytes()
+        available = max(self.memory_budget - resident, 0)
+        detail = ", ".join(f"{name} {format_mb(size)}" for name, size in stages.items())
+        headroom = f"{format_mb(available)} headroom above {format_mb(resident)} of resident datasets"
+        if peak <= available:
+            return None, f"in memory, estimated peak {format_mb(peak)} within the {headroom} ({detail})"
+        chunk_rows = max(GOVERNOR_MIN_CHUNK_ROWS, int(available * GOVERNOR_CHUNK_SHARE / (row_bytes + 2)))
+        spill = "sorted runs and result" if plan['sort'] is not None else "result"
+        return chunk_rows, (f"chunked, {chunk_rows:,} rows per chunk, {spill} on disk: estimated peak {format_mb(peak)}"
+                            f" is over the {headroom} ({detail})")
+    
+    def resident_bytes(self):
+        #"""Memory held by loaded data: this session's frame and stage caches, and the other datasets of the shared store"""
+        resident = estimate_bytes(self.df) + self.stage_cache_bytes()
+        if self.dataset_cache is not None:
+            stats = self.dataset_cache.stats()
+            entry = self.dataset_cache.get(self.shared_key) if self.shared_key is not None else None
+            resident += stats['bytes'] - (entry['nbytes'] if entry is not None else 0)
+        return resident
+    
+    def rollup_plan(self, plan):
+        #"""Keys of the rollup answering the current group aggregation, existing or worth building, None to aggregate rows"""
+        if not self.use_rollups or plan['scan'] != "memory" or not plan['grouping']:
+            return None
+        self._check_derived_structures()
+        group_columns = list(self.config['grouping']['columns'])
+        filter_columns = [rule['column'] for rule in self.config['filters']]
+        measures = [agg['column'] for agg in self.config['aggregations']]
+        selected = self.config['selected_columns']
+        # Invalid configurations are reported by the row aggregation
+        for col in group_columns + filter_columns + measures:
+            if col not in self.df.columns or (selected and col not in selected):
+                return None
+        if not group_columns or not measures or not all(is_numeric_column(self.df[col]) for col in measures):
+            return None
+        needed = set(group_columns + filter_columns)
+        candidates = [keys for keys, rollup in self.rollups.items()
+                      if rollup is not None and needed <= set(keys) and set(measures) <= rollup['measures']]
+        if candidates:
+            return min(candidates, key=lambda keys: len(self.rollups[keys]['state']))
+        keys, _ = self.rollup_pattern(group_columns)
+        if keys is None or not needed <= set(keys) or set(measures) & set(keys):
+            return None
+        if keys in self.rollups and self.rollups[keys] is None:
+            return None
+        return keys
+    
+    def rollup_pattern(self, group_columns):
+        #"""Keys and measures of the rollup of a grouping used at least ROLLUP_MIN_USES times, (None, None) otherwise"""
+        uses = []
+        # Earlier executions and the query about to run
+        for config in self.query_history + [self.config]:
+            grouping = config.get('grouping') or {}
+            if grouping.get('enabled') and set(grouping.get('columns') or []) == set(group_columns):
+                uses.append(config)
+        if len(uses) < ROLLUP_MIN_USES:
+            return None, None
+        sample = self.df
+        if len(sample) > self.sample_rows:
+            sample = sample.iloc[::len(sample) // self.sample_rows]
+        max_values = min(ROLLUP_MAX_KEY_VALUES, len(sample) * ROLLUP_MAX_RATIO)
+        keys = list(group_columns)
+        measures = set()
+        for config in uses:
+            # Filtered columns with few values are kept as keys, so that their rules can run on the rollup
+            for rule in config.get('filters') or []:
+                col = rule['column']
+                if col not in keys and col in sample.columns and sample[col].nunique(dropna=False) <= max_values:
+                    keys.append(col)
+            for agg in config.get('aggregations') or []:
+                if agg['column'] in self.df.columns and is_numeric_column(self.df[agg['column']]):
+                    measures.add(agg['column'])
+        measures -= set(keys)
+        return tuple(keys), measures
+    
+    def process_rollup(self, plan):
+        #"""Group aggregation merged from the planned rollup, which is built first when missing"""
+        keys = plan['rollup']
+        group_columns = self.config['grouping']['columns']
+        aggregations = self.config['aggregations']
+        measures = {agg['column'] for agg in aggregations}
+        rollup = self.rollups.get(keys)
+        if rollup is None or not measures <= rollup['measures']:
+            # Measures of the grouping's earlier uses and of an outgrown rollup are kept too
+            measures |= self.rollup_pattern(group_columns)[1] or set()
+            if rollup is not None:
+                measures |= rollup['measures']
+            measures -= set(keys)
+            self.progress("build rollup", len(self.df))
+            with profile_stage(self.profiler, "build rollup", len(self.df)) as entry:
+                rollup_aggs = [{"column": col, "function": func} for col in sorted(measures) for func in ROLLUP_FUNCTIONS]
+                # Missing keys form groups of their own, coarser groupings drop them as the row aggregation does
+                rollup = {"measures": measures, "state": partial_aggregate(self.df, list(keys), rollup_aggs, dropna=False)}
+                entry['rows_out'] = len(rollup['state'])
+            self.rollups[keys] = rollup if len(rollup['state']) <= len(self.df) * ROLLUP_MAX_RATIO else None
+            while len(self.rollups) > ROLLUP_MAX_ENTRIES:
+                self.rollups.popitem(last=False)
+        if keys in self.rollups:
+            self.rollups.move_to_end(keys)
+        
+        state = rollup['state']
+        self.progress("aggregation", len(state))
+        filters = [estimate['rule'] for estimate in plan['filters']]
+        if filters:
+            # Every row of a rollup group has the group's key values, rules on keys filter whole groups
+            with profile_stage(self.profiler, "filter rollup", len(state)) as entry:
+                mask = np.ones(len(state), dtype=bool)
+                for filter_rule in filters:
+                    level = pd.Series(state.index.get_level_values(filter_rule['column']))
+                    mask &= mask_to_array(build_series_mask(level, filter_rule))
+                state = state[mask]
+                entry['rows_out'] = len(state)
+        with profile_stage(self.profiler, "merge rollup", len(state)) as entry:
+            result_df = finalize_aggregates(merge_partial_aggregates([state], list(group_columns)), aggregations)
+            entry['rows_out'] = len(result_df)
+        return flatten_columns(result_df)
+    
+    def explain(self):
+        #"""Describe the execution plan of the current configuration"""
+        plan = self.plan_query()
+        chunk_rows, decision = self.govern_memory(plan)
+        if chunk_rows is not None:
+            plan['parallel'] = False
+        scans = {
+            "memory": f"in-memory frame ({len(self.df)} rows, no copy)",
+            "columnar": f"memory-mapped columnar cache ({self.columnar.num_rows if self.columnar is not None else 0} rows)",
+            "csv_chunks": f"CSV in chunks of {self.chunk_size} rows",
+            "partitions": f"partitioned dataset ({len(self.dataset.files) if self.dataset is not None else 0} files)",
+            "follow": f"rows appended to {self.follow.path if self.follow is not None else ''} after byte {self.follow.offset if self.follow is not None else 0}"
+        }
+        lines = [f"1. Scan: {scans[plan['scan']]}"]
+        if plan['partitions'] is not None:
+            blocks = sum(len(keep) for _, keep in plan['partitions'])
+            lines.append(f"   Zone maps: reading {len(plan['partitions'])} of {len(self.dataset.files)} files,"
+                         f" {blocks} of {self.dataset.blocks} blocks")
+        lines.append(f"   Columns: {', '.join(plan['columns']) if plan['columns'] is not None else 'all'}")
+        if plan['parallel']:
+            lines.append(f"   Parallel: {self.workers} worker processes over {self.workers * 2} row partitions (memory-mapped Arrow)")
+        if plan['filters']:
+            lines.append("2. Filter: conjunctive rules fused into one mask, single final take")
+            if plan['scan'] == "memory" and not plan['parallel'] and chunk_rows is None:
+                rules = [estimate['rule'] for estimate in plan['filters']]
+                positions, remaining = self.reused_positions(self.rule_set(self.df, rules), rules)
+                if positions is not None:
+                    lines.append(f"   Reuse: positions of {len(rules) - len(remaining)} rules kept from an earlier query,"
+                                 f" {len(remaining)} new rules evaluated on {len(positions)} rows")
+            for i, estimate in enumerate(plan['filters'], 1):
+                rule = estimate['rule']
+                access = f", via {ACCESS_LABELS[estimate['index']]}" if estimate['index'] else ""
+                lines.append(f"   {i}) {rule['column']} {rule['operator']} {rule['value']!r}"
+                             f" - cost {estimate['cost']}, estimated selectivity {estimate['selectivity']:.1%}{access}")
+        else:
+            lines.append("2. Filter: none")
+        if plan['sort'] is not None:
+            sort_columns, ascending = plan['sort']
+            lines.append("3. Sort: " + ", ".join(f"{col} {'asc' if asc else 'desc'}" for col, asc in zip(sort_columns, ascending)))
+            if plan['scan'] not in ("csv_chunks", "partitions") and not plan['parallel'] and chunk_rows is None:
+                lines.append("   Lazy: previews select the top rows per page, the full sort runs at export")
+        elif self.config['sorting']:
+            lines.append("3. Sort: skipped, group aggregation output is ordered by group keys")
+        else:
+            lines.append("3. Sort: none")
+        if plan['grouping']:
+            aggregations = ", ".join(f"{agg['function']}({agg['column']})" for agg in self.config['aggregations'])
+            lines.append(f"4. Group by {', '.join(self.config['grouping']['columns'])}: {aggregations}")
+            if plan['scan'] == "follow":
+                lines.append("   Incremental: partial states of the new rows are merged into the kept state")
+            if plan['rollup'] is not None:
+                rollup = self.rollups.get(plan['rollup'])
+                measures = {agg['column'] for agg in self.config['aggregations']}
+                rows = f"{len(rollup['state'])} rows" if rollup is not None and measures <= rollup['measures'] else "built by this run"
+                lines.append(f"   Rollup over ({', '.join(plan['rollup'])}): {rows}, filtered on its keys and merged to the groups")
+        else:
+            lines.append("4. Group aggregation: none")
+        if decision is not None:
+            lines.append(f"5. Memory: {decision}")
+        return "\n".join(lines)
+    
+    def referenced_columns(self):
+        #"""Columns the configuration needs, None when all columns are needed"""
+        if self.config['selected_columns']:
+            return list(self.config['selected_columns'])
+        if not (self.config['grouping'] and self.config['grouping']['enabled']):
+            return None
+        columns = [rule['column'] for rule in self.config['filters']]
+        columns += [rule['column'] for rule in self.config['sorting']]
+        columns += self.config['grouping']['columns']
+        columns += [agg['column'] for agg in self.config['aggregations']]
+        return list(dict.fromkeys(columns))
+    
+    def read_columnar(self, columns=None):
+        #"""Materialize columns of the memory-mapped table, only these pages are read"""
+        table = self.columnar
+        if columns is not None:
+            table = table.select([col for col in table.column_names if col in columns])
+        return table.to_pandas()
+    
+    def get_sort_spec(self):
+        #"""Get sort columns and directions"""
+        sort_columns = []
+        ascending = []
+        for sort_rule in self.config['sorting']:
+            sort_columns.append(sort_rule['column'])
+            ascending.append(sort_rule['ascending'])
+        return sort_columns, ascending
+    
     def process_data(self):
         #"""Process data according to configuration"""
         if self.df is None:
             return False, "Please upload CSV file first"
         
+        self.profiler = StageProfiler(self.profile_memory) if self.profile else None
+        lazy_sort = None
+        key = None
+        plan = None
+        self.memory_decision = None
         try:
-            # Copy original data
-            result_df = self.df.copy()
-            
-            # 1. Application column selection
-            if self.config['selected_columns']:
-                result_df = result_df[self.config['selected_columns']]
-            
-            # 2. Apply filtering conditions
-            for filter_rule in self.config['filters']:
-                col = filter_rule['column']
-                operator = filter_rule['operator']
-                value = filter_rule['value']
+            self.progress("planning")
+            if self.result_cache is not None:
+                with profile_stage(self.profiler, "result cache") as entry:
+                    key = self.result_key()
+                    cached = self.result_cache.get(key) if key is not None else None
+                    entry['rows_out'] = len(cached) if cached is not None else None
+                if cached is not None:
+                    self.progress("done", fraction=1.0)
+                    self.result = cached
+                    return True, f"Data processing completed (cached result)! The result contains {len (cached)} rows and {len (cached. columns)} columns"
+            plan = self.plan_query()
+            filters = [estimate['rule'] for estimate in plan['filters']]
+            chunk_rows, self.memory_decision = self.govern_memory(plan)
+            if chunk_rows is not None:
+                plan['parallel'] = False
+            if self.source is not None:
+                result_df = self.process_chunked(plan)
+            elif self.dataset is not None:
+                result_df = self.process_partitions(plan)
+            elif plan['rollup'] is not None:
+                result_df = self.process_rollup(plan)
+            elif self.follow is not None:
+                result_df = self.process_follow(plan)
+                if plan['sort'] is not None:
+                    missing = [col for col in plan['sort'][0] if col not in result_df.columns]
+                    if missing:
+                        raise KeyError(missing[0])
+                    lazy_sort = plan['sort']
+            elif chunk_rows is not None:
+                result_df = self.process_frame_chunks(plan, chunk_rows)
+            elif plan['parallel']:
+                result_df = self.process_parallel(plan)
+            else:
+                if self.columnar is not None:
+                    # Page in only the referenced columns of the columnar cache
+                    with profile_stage(self.profiler, "scan columnar") as entry:
+                        result_df = self.read_columnar(plan['columns'])
+                        entry['rows_out'] = len(result_df)
+                else:
+                    # No up-front copy, the single take below materializes the result
+                    result_df = self.df
                 
-                # Attempt to convert value type
-                try:
-                    if result_df[col].dtype == 'float64' or result_df[col].dtype == 'int64':
-                        value = float(value)
-                except:
-                    pass
+                # 1-2. Column selection and filtering conditions
+                result_df = self.apply_filters(result_df, filters, plan['columns'])
                 
-                if operator == 'eq':
-                    result_df = result_df[result_df[col] == value]
-                elif operator == 'ne':
-                    result_df = result_df[result_df[col] != value]
-                elif operator == 'gt':
-                    result_df = result_df[result_df[col] > value]
-                elif operator == 'ge':
-                    result_df = result_df[result_df[col] >= value]
-                elif operator == 'lt':
-                    result_df = result_df[result_df[col] < value]
-                elif operator == 'le':
-                    result_df = result_df[result_df[col] <= value]
-                elif operator == 'contains':
-                    result_df = result_df[result_df[col].astype(str).str.contains(str(value), na=False)]
-                elif operator == 'regex':
-                    try:
-                        result_df = result_df[result_df[col].astype(str).str.match(str(value), na=False)]
-                    except re.error:
-                        st.error(f"Regular expression error: {value}")
-                        return False, "Regular expression syntax error"
-                elif operator == 'isnull':
-                    result_df = result_df[result_df[col].isna()]
-                elif operator == 'notnull':
-                    result_df = result_df[result_df[col].notna()]
-                elif operator == 'in':
-                    values = [v.strip() for v in value.split(',')]
-                    result_df = result_df[result_df[col].isin(values)]
+                # 3. Sorting rules are applied lazily: previews select the top rows, exports sort everything
+                if plan['sort'] is not None:
+                    missing = [col for col in plan['sort'][0] if col not in result_df.columns]
+                    if missing:
+                        raise KeyError(missing[0])
+                    lazy_sort = plan['sort']
+                
+                # 4. Application group aggregation (optional)
+                if plan['grouping']:
+                    group_columns = self.config['grouping']['columns']
+                    agg_dict = build_agg_dict(self.config['aggregations'])
+                    self.progress("aggregation", len(result_df))
+                    
+                    with profile_stage(self.profiler, "aggregation", len(result_df)) as entry:
+                        # Categorical values only support count / min / max, others run on the decoded values
+                        decoded = {col: result_df[col].astype(object) for col, funcs in agg_dict.items()
+                                   if isinstance(result_df[col].dtype, pd.CategoricalDtype)
+                                   and any(func not in ('count', 'min', 'max') for func in funcs)}
+                        if decoded:
+                            result_df = result_df.assign(**decoded)
+                        
+                        # Perform group aggregation
+                        result_df = result_df.groupby(group_columns, observed=True).agg(agg_dict).reset_index()
+                        entry['rows_out'] = len(result_df)
+                    
+                    # Flattening multi-level column names
+                    with profile_stage(self.profiler, "flatten columns", len(result_df)) as entry:
+                        result_df = flatten_columns(result_df)
+                        entry['rows_out'] = len(result_df)
             
-            # 3. Apply sorting rules
-            if self.config['sorting']:
-                sort_columns = []
-                ascending = []
-                for sort_rule in self.config['sorting']:
-                    sort_columns.append(sort_rule['column'])
-                    ascending.append(sort_rule['ascending'])
-                result_df = result_df.sort_values(by=sort_columns, ascending=ascending)
+            if plan['grouping']:
+                # Executed queries count towards rollups, not the configuration updates of every rerun
+                self.query_history = (self.query_history + [copy.deepcopy(self.config)])[-ROLLUP_HISTORY:]
+            self.progress("done", fraction=1.0)
+            self.result = result_df if isinstance(result_df, SpilledResult) else LazyResult(result_df, lazy_sort)
+            # The loaded frame itself costs nothing to return again, disk-backed results are too large to keep in memory
+            if key is not None and result_df is not self.df and isinstance(self.result, LazyResult):
+                self.result_cache.put(key, self.result)
+            return True, f"Data processing completed! The result contains {len (result_df)} rows and {len (result_df. columns)} columns"
+        except QueryCancelled:
+            return False, "Data processing cancelled"
+        except MemoryError:
+            # The estimate fell short: the attempt's buffers are released and the plan runs again in small chunks
+            result_df = None
+            if plan is None or plan['scan'] not in ("memory", "columnar") or plan['rollup'] is not None:
+                return False, "Data processing ran out of memory, use streaming mode or a memory budget"
+            self.memory_decision = f"chunked, {GOVERNOR_MIN_CHUNK_ROWS:,} rows per chunk, after running out of memory in memory"
+            try:
+                result_df = self.process_frame_chunks(plan, GOVERNOR_MIN_CHUNK_ROWS)
+            except MemoryError:
+                return False, "Data processing ran out of memory, even in chunks"
+            except Exception as e:
+                return False, f"Error occurred during data processing: {str(e)}"
+            self.result = result_df if isinstance(result_df, SpilledResult) else LazyResult(result_df)
+            return True, f"Data processing completed in chunks after running out of memory! The result contains {len (result_df)} rows and {len (result_df. columns)} columns"
+        except re.error as e:
+            # Reported through the returned message, the query may run on a background thread
+            return False, f"Regular expression syntax error in {e.pattern!r}: {e}"
+        except Exception as e:
+            return False, f"Error occurred during data processing: {str(e)}"
+        finally:
+            if self.profiler is not None:
+                self.profiler.finish()
+                if self.log_profile:
+                    self.profiler.log()
+            self.last_profile = self.profiler
+            self.profiler = None
+    
+    def preview_sample(self):
+        #"""Reservoir sample of the loaded data, None until the first full scan of a source read in chunks"""
+        if self.reservoir is None or self.reservoir.capacity != self.preview_rows:
+            if self.source is not None or self.dataset is not None or self.follow is not None:
+                # Files are not read again for the sample, the scans of the queries draw it
+                return None
+            reservoir = ReservoirSample(self.preview_rows)
+            if self.columnar is not None:
+                # Only the accepted rows of each record batch are converted
+                for batch in self.columnar.to_batches():
+                    reservoir.offer(batch.num_rows, lambda positions: batch.take(pa.array(positions)).to_pandas())
+            else:
+                reservoir.add(self.df)
+            self.reservoir = reservoir
+        return self.reservoir
+    
+    def estimated_rows(self):
+        #"""Rows of the loaded data, estimated from the file size and the loaded rows for sources read in chunks"""
+        if self.dataset is not None:
+            return self.dataset.rows
+        if self.columnar is not None:
+            return self.columnar.num_rows
+        if self.follow is not None:
+            size = os.path.getsize(self.follow.path)
+        elif self.source is not None:
+            size = os.path.getsize(self.source) if is_path(self.source) else source_size(self.source)
+        else:
+            return len(self.df)
+        row_bytes = len(self.df.to_csv(index=False, header=False).encode('utf-8')) / max(len(self.df), 1)
+        return max(len(self.df), round(size / row_bytes)) if size and row_bytes else len(self.df)
+    
+    def preview_data(self):
+        #"""Run the configuration on the reservoir sample, row counts and group aggregates become estimates"""
+        if self.df is None:
+            return False, "Please upload CSV file first"
+        try:
+            reservoir = self.preview_sample()
+            state = (json.dumps(self.config, sort_keys=True, default=str), reservoir)
+            if state == self.preview_state:
+                return True, self.preview_message
             
-            # 4. Application group aggregation (optional)
+            # A few thousand rows: no indexes, encodings, worker processes or background job
+            if reservoir is not None:
+                sample, population = reservoir.sample(), reservoir.seen
+            else:
+                # The first rows stand in for the sample until a query scanned the whole source
+                sample, population = self.df.head(self.preview_rows), self.estimated_rows()
+            clone = copy.copy(self)
+            clone.df, clone.source, clone.columnar, clone.dataset, clone.follow = sample, None, None, None, None
+            clone.indexes, clone.encodings, clone.indexed_df = {}, {}, sample
+            clone.filter_states, clone.selection_state = OrderedDict(), None
+            clone.use_rollups, clone.rollups = False, OrderedDict()
+            clone.use_indexes, clone.dictionary_encode, clone.workers = False, False, 1
+            clone.job, clone.profile, clone.log_profile = None, False, False
+            # Sample results must not be cached as results of the whole dataset
+            clone.result_cache = None
+            clone.memory_budget = 0
+            success, message = clone.process_data()
+            if not success:
+                return False, message
+            
+            rows = len(sample)
+            result_df = clone.result.df
             if self.config['grouping'] and self.config['grouping']['enabled']:
                 group_columns = self.config['grouping']['columns']
-                agg_config = self.config['aggregations']
-                
-                # Build Aggregation Configuration
-                agg_dict = {}
-                for agg in agg_config:
-                    col = agg['column']
-                    func = agg['function']
-                    if col not in agg_dict:
-                        agg_dict[col] = []
-                    agg_dict[col].append(func)
-                
-                # Perform group aggregation
-                result_df = result_df.groupby(group_columns).agg(agg_dict).reset_index()
-                
-                # Flattening multi-level column names
-                result_df.columns = ['_'.join(col).strip() for col in result_df.columns.values]
-            
-            self.processed_df = result_df
-            return True, f"Data processing completed! The result contains {len (resultd_df)} rows and {len (resultd_df. columns)} columns"
+                estimates = estimate_aggregates(clone.apply_filters(sample), group_columns, self.config['aggregations'], rows, population)
+                # Same groups in the same order as the sample result, aggregates replaced by their estimates
+                keys = result_df.iloc[:, :len(group_columns)].reset_index(drop=True)
+                result_df = pd.concat([keys, estimates.iloc[:, len(group_columns):]], axis=1)
+                note = f"{len(result_df)} groups, aggregates are estimates with 95% confidence intervals (±)"
+            else:
+                estimate, half = estimate_count(len(result_df), rows, population)
+                note = f"about {estimate:,.0f} ± {half:,.0f} matching rows (95% confidence)"
+            self.preview = LazyResult(result_df, clone.result.sort)
+            self.preview_state = state
+            if reservoir is not None:
+                self.preview_message = f"Sample preview on {rows:,} of {population:,} rows: {note}"
+            else:
+                self.preview_message = f"Preview on the first {rows:,} of about {population:,} rows, a uniform sample is drawn by the first full run: {note}"
+            return True, self.preview_message
         except Exception as e:
-            return False, f"Error occurred during data processing: {str(e)}"
+            return False, f"Error occurred during sample preview: {str(e)}"
+    
+    def progress(self, stage, rows=None, fraction=None):
+        #"""Report progress to the background job, the checkpoint where a cancelled query stops"""
+        if self.job is not None:
+            self.job.update(stage, rows, fraction)
+    
+    def snapshot(self):
+        #"""Copy sharing the loaded data, with its own configuration and result"""
+        # Indexes and encodings built by the query stay available to this processor
+        self._check_derived_structures()
+        clone = copy.copy(self)
+        clone.config = copy.deepcopy(self.config)
+        clone.result = None
+        clone.profiler = None
+        clone.job = None
+        # The job extends its own copies of the stage states while reruns read these, collect takes them back
+        clone.indexes, clone.encodings = dict(self.indexes), dict(self.encodings)
+        clone.filter_states, clone.rollups = OrderedDict(self.filter_states), OrderedDict(self.rollups)
+        if self.source is not None:
+            # The query rereads the upload while reruns of the script read it too
+            if hasattr(self.source, 'getvalue'):
+                clone.source = io.BytesIO(self.source.getvalue())
+            elif isinstance(getattr(self.source, 'name', None), str) and os.path.exists(self.source.name):
+                clone.source = open(self.source.name, 'rb')
+        return clone
+    
+    def submit(self, executor):
+        #"""Run process_data on a snapshot in the background, returns the job handle"""
+        clone = self.snapshot()
+        if self.dataset is not None:
+            rows = self.dataset.rows
+        else:
+            rows = self.columnar.num_rows if self.columnar is not None else (len(self.df) if self.source is None else None)
+        job = QueryJob(clone, rows)
+        clone.job = job
+        job.future = executor.submit(clone.process_data)
+        return job
+    
+    def collect(self, job):
+        #"""Take over the result of a finished job, returns its (success, message)"""
+        success, message = job.outcome()
+        if not job.collected:
+            job.collected = True
+            if success:
+                self.result = job.processor.result
+            self.last_profile = job.processor.last_profile
+            self.memory_decision = job.processor.memory_decision
+            clone = job.processor
+            self.query_history = clone.query_history
+            if clone.df is self.df:
+                # Stage states, fingerprint and worker file the job built for the data still loaded
+                self.indexes, self.encodings = clone.indexes, clone.encodings
+                self.filter_states, self.selection_state, self.rollups = clone.filter_states, clone.selection_state, clone.rollups
+                # Preview sample drawn or extended by the scan of the job
+                self.reservoir = clone.reservoir
+                if self.fingerprint is None:
+                    self.fingerprint = clone.fingerprint
+                if clone.shared_df is self.df and self.shared_df is not self.df:
+                    # Registered for this processor while the finished job still holds the file
+                    self.shared_table_path()
+        return success, message
+    
+    def shared_table_path(self):
+        #"""Arrow file the worker processes memory-map, one per dataset shared by the processors that loaded it"""
+        if self.columnar is not None:
+            return self.columnar_cache.path(self.cache_key())
+        if self.shared_df is not self.df:
+            # Frames without a fingerprint are only shared by the processors holding that frame
+            key = self.cache_key() if self.fingerprint is not None else f"frame-{id(self.df)}"
+            path = get_shared_tables().acquire(key, self.df, self)
+            if self.shared_table != key:
+                self.release_shared_table()
+            self.shared_table, self.shared_path, self.shared_df = key, path, self.df
+        return self.shared_path
+    
+    def release_shared_table(self):
+        #"""Let go of the Arrow file shared with the worker processes"""
+        if self.shared_table is not None:
+            get_shared_tables().release(self.shared_table, self)
+        self.shared_table, self.shared_path, self.shared_df = None, None, None
+    
+    def process_parallel(self, plan):
+        #"""Filter, sort or aggregate row partitions in worker processes and combine the results"""
+        filters = [estimate['rule'] for estimate in plan['filters']]
+        # Invalid rules fail here with the same errors as the single-core path
+        self.apply_filters(self.df.iloc[:0], filters, plan['columns'])
+        for filter_rule in filters:
+            if filter_rule['operator'] in ('contains', 'regex'):
+                re.compile(str(filter_rule['value']))
+        
+        grouping = None
+        needed = [filter_rule['column'] for filter_rule in filters]
+        if plan['grouping']:
+            grouping = (self.config['grouping']['columns'], self.config['aggregations'])
+            needed += grouping[0] + [agg['column'] for agg in grouping[1]]
+        elif plan['sort'] is not None:
+            needed += plan['sort'][0]
+        missing = [col for col in needed if col not in self.df.columns]
+        if missing:
+            raise KeyError(missing[0])
+        
+        rows = self.columnar.num_rows if self.columnar is not None else len(self.df)
+        bounds = np.linspace(0, rows, self.workers * 2 + 1).astype(np.int64)
+        path = self.shared_table_path()
+        tasks = [{
+            "path": path,
+            "start": int(start),
+            "stop": int(stop),
+            "columns": list(dict.fromkeys(needed)),
+            "filters": filters,
+            "sort": plan['sort'],
+            "grouping": grouping
+        } for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        with profile_stage(self.profiler, f"partitions ({len(tasks)} in {self.workers} processes)", rows) as entry:
+            pool = get_worker_pool(self.workers)
+            futures = [pool.submit(partition_worker(), task) for task in tasks]
+            results = []
+            try:
+                for future in futures:
+                    results.append(future.result())
+                    self.progress("partitions", sum(task['stop'] - task['start'] for task in tasks[:len(results)]),
+                                  len(results) / len(tasks))
+            except QueryCancelled:
+                for future in futures:
+                    future.cancel()
+                raise
+            entry['rows_out'] = sum(len(result) for result in results)
+        
+        # Reduce: partial aggregates merge exactly like the chunked path
+        if grouping is not None:
+            with profile_stage(self.profiler, "merge aggregates", entry.get('rows_out')) as entry:
+                state = merge_partial_aggregates(results)
+                result_df = finalize_aggregates(state, self.config['aggregations'])
+                entry['rows_out'] = len(result_df)
+            with profile_stage(self.profiler, "flatten columns", len(result_df)) as entry:
+                result_df = flatten_columns(result_df)
+                entry['rows_out'] = len(result_df)
+            return result_df
+        
+        # Sorted partitions are k-way merged, ties keep partition (row) order
+        if plan['sort'] is not None:
+            block_rows = 10000
+            runs = [run for run in results if len(run) > 0]
+            readers = [iter([run.iloc[i:i + block_rows] for i in range(0, len(run), block_rows)]) for run in runs]
+            counts = [-(-len(run) // block_rows) for run in runs]
+            with profile_stage(self.profiler, "merge sorted runs", entry.get('rows_out')) as entry:
+                merged = [block.index.to_numpy() for block in merge_sorted_runs(readers, counts, *plan['sort'])]
+                positions = np.concatenate(merged) if merged else np.array([], dtype=np.int64)
+                entry['rows_out'] = len(positions)
+        else:
+            positions = np.concatenate(results)
+        
+        # Single take of the matching rows in their final order
+        base = self.read_columnar(plan['columns']) if self.columnar is not None else self.df
+        columns = plan['columns']
+        with profile_stage(self.profiler, "selection", rows) as entry:
+            if columns is not None:
+                result_df = base.iloc[positions, base.columns.get_indexer(columns)]
+            else:
+                result_df = base.iloc[positions]
+            entry['rows_out'] = len(result_df)
+        return result_df
+    
+    def process_chunked(self, plan):
+        #"""Process the streaming source chunk by chunk with bounded memory"""
+        filters = [estimate['rule'] for estimate in plan['filters']]
+        columns = plan['columns']
+        
+        # Server-side files are opened here, so that progress can follow the read position
+        source = self._rewind_source()
+        if is_path(source):
+            source = open(source, 'rb')
+        # The first full scan draws the preview sample, reading every column for it
+        sampler = ReservoirSample(self.preview_rows) if self.reservoir is None or self.reservoir.capacity != self.preview_rows else None
+        try:
+            chunks = self._csv_chunks(source, columns if sampler is None else None)
+            result = self._process_chunks(plan, sampled_chunks(chunks, sampler), "scan csv chunks", filters, columns)
+        finally:
+            if source is not self.source:
+                source.close()
+        if sampler is not None:
+            self.reservoir = sampler
+        return result
+    
+    def _csv_chunks(self, source, columns):
+        #"""Frames of an open CSV source with the fraction of it read so far"""
+        size = source_size(source)
+        # Projection pushdown: only the referenced columns are parsed
+        for chunk in PandasParser(self.encoding).read_chunks(source, self.chunk_size, columns):
+            yield chunk, source.tell() / size if size else None
+    
+    def process_partitions(self, plan):
+        #"""Chunked execution over the blocks of the partitioned dataset that its zone maps do not rule out"""
+        filters = [estimate['rule'] for estimate in plan['filters']]
+        # A scan of every block draws the preview sample, reading every column for it
+        sampler = None
+        if self.reservoir is None or self.reservoir.capacity != self.preview_rows:
+            if sum(len(keep) for _, keep in plan['partitions']) == sum(len(entry['blocks']) for entry in self.dataset.files):
+                sampler = ReservoirSample(self.preview_rows)
+        chunks = self.dataset.scan(plan['partitions'], plan['columns'] if sampler is None else None)
+        result = self._process_chunks(plan, sampled_chunks(chunks, sampler), "scan partitions", filters, plan['columns'])
+        if sampler is not None:
+            self.reservoir = sampler
+        return result
+    
+    def process_follow(self, plan):
+        #"""Apply the configuration to the rows appended since the last run and extend the kept results with them"""
+        follow = self.follow
+        filters = [estimate['rule'] for estimate in plan['filters']]
+        columns = plan['columns']
+        group_columns = self.config['grouping']['columns'] if plan['grouping'] else None
+        stat = os.stat(follow.path)
+        # Kept results only hold for their configuration and for the file they were read from
+        key = self.canonical_config()
+        if key != follow.key or stat.st_ino != follow.inode or stat.st_size < follow.offset:
+            follow.reset(key, stat.st_ino)
+        
+        # Nothing is kept until the run completes, a cancelled run leaves the previous results intact
+        header, offset, rows = follow.header, follow.offset, follow.rows
+        if header is None:
+            header = read_header(follow.path)
+            offset = len(header) if header is not None else 0
+        start = offset
+        partials = [follow.state] if follow.state is not None else []
+        pieces = [follow.matched] if follow.matched is not None else []
+        # The preview sample takes the new rows when it covers the rows read so far, a read from the first row draws a new one
+        sampler = None
+        if self.reservoir is not None and self.reservoir.capacity == self.preview_rows and self.reservoir.seen == rows:
+            sampler = copy.deepcopy(self.reservoir)
+        elif rows == 0:
+            sampler = ReservoirSample(self.preview_rows)
+        read_columns = columns if sampler is None else None
+        chunks = read_appended(follow.path, offset, header, self.chunk_size, read_columns, self.encoding) if header is not None else iter(())
+        while True:
+            with profile_stage(self.profiler, "scan appended rows") as entry:
+                chunk, end = next(chunks, (None, None))
+                entry['rows_out'] = len(chunk) if chunk is not None else 0
+            if chunk is None:
+                break
+            rows += len(chunk)
+            offset = end
+            self.progress("scan appended rows", rows, (end - start) / max(stat.st_size - start, 1))
+            if sampler is not None:
+                sampler.add(chunk)
+            chunk = self.apply_filters(chunk, filters, columns)
+            if group_columns is not None:
+                with profile_stage(self.profiler, "partial aggregation", len(chunk)) as entry:
+                    partials.append(partial_aggregate(chunk, group_columns, self.config['aggregations']))
+                    if len(partials) >= 16:
+                        partials = [merge_partial_aggregates(partials)]
+                    entry['rows_out'] = len(partials[-1])
+            else:
+                pieces.append(chunk)
+        
+        if group_columns is not None:
+            if not partials:
+                partials.append(partial_aggregate(self.apply_filters(self.df.iloc[:0], filters, columns), group_columns, self.config['aggregations']))
+            with profile_stage(self.profiler, "merge aggregates") as entry:
+                state = merge_partial_aggregates(partials) if len(partials) > 1 else partials[0]
+                result_df = finalize_aggregates(state, self.config['aggregations'])
+                entry['rows_out'] = len(result_df)
+            result_df = flatten_columns(result_df)
+            matched = None
+        else:
+            state = None
+            matched = pd.concat(pieces) if len(pieces) > 1 else (pieces[0] if pieces else self.apply_filters(self.df.iloc[:0], filters, columns))
+            result_df = matched
+        
+        if sampler is not None:
+            self.reservoir = sampler
+        elif rows != follow.rows:
+            # The preview sample no longer covers the whole file
+            self.reservoir = None
+        follow.header, follow.offset, follow.rows, follow.state, follow.matched = header, offset, rows, state, matched
+        return result_df
+    
+    def process_frame_chunks(self, plan, chunk_rows):
+        #"""Chunked execution over the loaded frame or the columnar table, for plans over the memory budget"""
+        filters = [estimate['rule'] for estimate in plan['filters']]
+        columns = plan['columns']
+        # The merge of a sort holds one block of every sorted run and sorts them together, about a chunk in all
+        total = self.columnar.num_rows if self.columnar is not None else len(self.df)
+        block_rows = chunk_rows // (3 * max(-(-total // chunk_rows), 1))
+        if self.columnar is not None:
+            table = self.columnar
+            if columns is not None:
+                table = table.select([col for col in table.column_names if col in columns])
+            total = table.num_rows
+            batches = table.to_batches(max_chunksize=chunk_rows)
+            offsets = np.cumsum([batch.num_rows for batch in batches])
+            chunks = ((batch.to_pandas(), done / total) for batch, done in zip(batches, offsets))
+        else:
+            total = len(self.df)
+            chunks = ((self.df.iloc[start:start + chunk_rows], min(start + chunk_rows, total) / total)
+                      for start in range(0, total, chunk_rows))
+        return self._process_chunks(plan, chunks, "scan frame chunks", filters, columns,
+                                    max(min(block_rows, 10000), GOVERNOR_MIN_BLOCK_ROWS))
+    
+    def _process_chunks(self, plan, chunks, stage, filters, columns, sort_block_rows=10000):
+        #"""Chunked execution over (frame, fraction read) pairs, row results are written to a disk-backed result"""
+        sorter = None
+        if plan['sort'] is not None:
+            sort_columns, ascending = plan['sort']
+            sorter = ExternalSorter(sort_columns, ascending, block_rows=sort_block_rows)
+        partials = []
+        spilled = None if plan['grouping'] or sorter is not None else SpilledResult()
+        # Spill files of a cancelled or failed run are removed with it
+        try:
+            scanned = 0
+            while True:
+                with profile_stage(self.profiler, stage) as entry:
+                    chunk, fraction = next(chunks, (None, None))
+                    entry['rows_out'] = len(chunk) if chunk is not None else 0
+                if chunk is None:
+                    break
+                scanned += len(chunk)
+                self.progress(stage, scanned, fraction)
+                chunk = self.apply_filters(chunk, filters, columns)
+                if plan['grouping']:
+                    with profile_stage(self.profiler, "partial aggregation", len(chunk)) as entry:
+                        partials.append(partial_aggregate(chunk, self.config['grouping']['columns'], self.config['aggregations']))
+                        # Keep the number of pending partial states bounded
+                        if len(partials) >= 16:
+                            partials = [merge_partial_aggregates(partials)]
+                        entry['rows_out'] = len(partials[-1])
+                elif sorter is not None:
+                    with profile_stage(self.profiler, "sort runs", len(chunk)) as entry:
+                        sorter.add(chunk)
+                        entry['rows_out'] = len(chunk)
+                else:
+                    spilled.append(chunk)
+        
+            # Group aggregation: the merged state is independent of the row order
+            if plan['grouping']:
+                if not partials:
+                    partials.append(partial_aggregate(self.apply_filters(self.df.iloc[:0], filters, columns), self.config['grouping']['columns'], self.config['aggregations']))
+                with profile_stage(self.profiler, "merge aggregates") as entry:
+                    state = merge_partial_aggregates(partials)
+                    result_df = finalize_aggregates(state, self.config['aggregations'])
+                    entry['rows_out'] = len(result_df)
+                with profile_stage(self.profiler, "flatten columns", len(result_df)) as entry:
+                    result_df = flatten_columns(result_df)
+                    entry['rows_out'] = len(result_df)
+                return result_df
+        
+            empty = self.apply_filters(self.df.iloc[:0], filters, columns)
+            if sorter is not None:
+                if not sorter.runs:
+                    # Missing sort columns fail like in memory
+                    empty.sort_values(by=plan['sort'][0], ascending=plan['sort'][1])
+                # Merged blocks go straight to disk, one block per run is held in memory
+                with profile_stage(self.profiler, "merge sorted runs") as entry:
+                    spilled = SpilledResult()
+                    for block in sorter.merge():
+                        spilled.append(block)
+                    entry['rows_out'] = len(spilled)
+            return spilled.close(empty)
+        except BaseException:
+            if spilled is not None:
+                spilled.discard()
+            raise
+        finally:
+            if sorter is not None:
+                sorter.close()
+    
+    @property
+    def processed_df(self):
+        #"""Fully materialized result, sorted on first access"""
+        return self.result.materialize() if self.result is not None else None
+    
+    @processed_df.setter
+    def processed_df(self, df):
+        self.result = LazyResult(df) if df is not None else None
+    
+    @property
+    def export_data(self):
+        #"""Result for streaming exports: a disk-backed result as is, others in their final order"""
+        if isinstance(self.result, SpilledResult):
+            return self.result
+        return self.processed_df
     
     def export_to_csv(self):
         #"""Export as CSV"""
         if self.processed_df is None:
             return None
-        return self.processed_df.to_csv(index=False).encode('utf-8')
+        return dates_as_text(self.processed_df).to_csv(index=False).encode('utf-8')
     
     def export_to_json(self):
         #"""Export as JSON"""
         if self.processed_df is None:
             return None
-        return self.processed_df.to_json(orient='records', indent=2).encode('utf-8')
+        return dates_as_text(self.processed_df).to_json(orient='records', indent=2).encode('utf-8')
+    
+    def export_file_name(self, name, export_format, compression="none"):
+        #"""File name of an export, with the compression suffix"""
+        extension = EXPORT_FORMATS[export_format][0]
+        suffix = EXPORT_COMPRESSION[compression][0] if export_format != "Parquet" else ""
+        return f"{name}.{extension}{suffix}"
+    
+    def export_mime(self, export_format, compression="none"):
+        #"""Mime type of an export"""
+        if export_format != "Parquet" and compression != "none":
+            return EXPORT_COMPRESSION[compression][1]
+        return EXPORT_FORMATS[export_format][1]
+    
+    def export_result(self, export_format, compression="none"):
+        #"""Stream the result into a file on disk and return its path"""
+        if self.result is None:
+            return None
+        if self.export_path is not None and os.path.exists(self.export_path):
+            os.remove(self.export_path)
+        fd, path = tempfile.mkstemp(suffix=f"-{self.export_file_name('result', export_format, compression)}", dir=private_temp_dir("exports"))
+        os.close(fd)
+        try:
+            write_export(self.export_data, path, export_format, compression)
+        except Exception:
+            os.remove(path)
+            raise
+        self.export_path = path
+        return path
+    
+    def export_bytes(self, export_format, compression="none"):
+        #"""Contents of a streamed export for a download"""
+        path = self.export_result(export_format, compression)
+        if path is None:
+            return b""
+        with open(path, 'rb') as handle:
+            return handle.read()
     
     def get_config_json(self):
         #"""Get JSON representation of configuration"""
+        if self.schema:
+            return json.dumps(dict(self.config, schema=self.schema), indent=2)
         return json.dumps(self.config, indent=2)
     
     def load_config_from_json(self, json_str):
         #"""Load configuration from JSON"""
         try:
-            self.config = json.loads(json_str)
+            config = json.loads(json_str)
+            # The schema profile is used by the next load, it is not part of the retrieval rules
+            self.schema = config.pop('schema', None)
+            self.config = config
             return True, "Configuration loaded successfully!"
         except Exception as e:
             return False, f"Configuration loading failed: {str(e)}"
@@ -259,6 +3438,14 @@ def get_download_link(data, filename, file_type):
 
 # Main processing-start
 def main():
+    # Set page（UI ) configuration
+    st.set_page_config(
+        page_title="CSV Data Retrieval and Conversion Tool-China mobile",
+        page_icon="??",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    
     # Loading UI CSS Styles
     load_css()
     
@@ -267,12 +3454,14 @@ def main():
         st.session_state.processor = CSVDataProcessor()
     
     processor = st.session_state.processor
+    processor.dataset_cache = get_dataset_cache()
+    processor.result_cache = get_result_cache()
     
     # TITLE of UI page
     st.title("?? CSV Data Retrieval and Conversion Tool-China Mobile")
     st.markdown("""
     <div style="color: #6c757d; margin-bottom: 30px;">
-        Upload CSV file, configure search rules, and export processed CSV or JSON file. Support functions such as field selection, filtering criteria, regular expressions, sorting rules, and group aggregation
+        Upload CSV file, configure search rules, and export processed CSV or JSON file. Support functions such as field selection, filtering criteria, regular expressions, sorting rules, and group aggregation。
     </div>
     """, unsafe_allow_html=True)
     
@@ -280,9 +3469,61 @@ def main():
     with st.sidebar:
         st.subheader("?? Upload CSV file")
         uploaded_file = st.file_uploader("Select CSV file", type=["csv"])
+        server_path = ""
+        if SERVER_ROOT:
+            server_path = st.text_input(f"Or a CSV file path under {SERVER_ROOT} on the server (memory-mapped), or a directory / glob of "
+                                        "CSV, Arrow and Parquet partitions queried as one dataset", value="").strip()
+        with st.expander("CSV parser"):
+            backends = ["auto", "pandas"] + (["pyarrow"] if pa is not None else [])
+            processor.parser_backend = st.selectbox("Parser backend (auto = multithreaded pyarrow when installed)", backends,
+                                                    index=backends.index(processor.parser_backend) if processor.parser_backend in backends else 0)
+            processor.parse_threads = int(st.number_input("Parser threads (0 = all cores)", min_value=0, max_value=os.cpu_count() or 1, value=processor.parse_threads or 0)) or None
+            processor.block_size = int(st.number_input("Block size (MB)", min_value=1, max_value=256, value=processor.block_size >> 20)) << 20
+            processor.encoding = st.text_input("Encoding", value=processor.encoding).strip() or "utf-8"
+        streaming = st.checkbox("Streaming mode for large files (process in chunks)", value=False)
+        follow = st.checkbox("Follow a growing server-side file (each run only reads appended rows)", value=processor.follow is not None)
+        if pa is not None:
+            columnar = st.checkbox("Keep a columnar disk cache (fast reopen after restarts)", value=processor.columnar_cache is not None)
+            processor.columnar_cache = ColumnarCache() if columnar else None
+        spill = st.checkbox("Spill evicted query results to disk", value=processor.result_cache.spill_dir is not None)
+        processor.result_cache.spill_dir = private_temp_dir("results") if spill else None
+        processor.optimize_dtypes = st.checkbox("Optimize column types at load (smaller memory)", value=processor.optimize_dtypes)
+        processor.workers = int(st.number_input("Worker processes (1 = single core)", min_value=1, max_value=os.cpu_count() or 1, value=processor.workers))
+        processor.use_indexes = st.checkbox("Build column indexes for repeated eq / in / range filters", value=processor.use_indexes)
+        processor.profile_memory = st.checkbox("Trace peak memory of each query stage (slower)", value=processor.profile_memory)
+        processor.log_profile = st.checkbox("Log the stage profile of every run", value=processor.log_profile)
+        if processor.log_profile:
+            enable_profile_logging()
+        if streaming:
+            processor.chunk_size = int(st.number_input("Rows per chunk", min_value=1000, value=processor.chunk_size, step=10000))
+        processor.preview_rows = int(st.number_input("Sample preview rows", min_value=100, value=processor.preview_rows, step=1000))
+        processor.memory_budget = int(st.number_input("Memory budget of the server process (MB, 0 = unlimited, larger queries run in chunks)",
+                                                      min_value=0, value=processor.memory_budget >> 20, step=256)) << 20
+        
+        source = uploaded_file
+        partitions = None
+        if source is None and server_path:
+            # Relative to the root, absolute paths and matches of a glob must resolve inside it
+            path = os.path.join(SERVER_ROOT, server_path)
+            if not glob.has_magic(path) and not inside_root(path, SERVER_ROOT):
+                st.error(f"Only files under {SERVER_ROOT} can be opened")
+            elif os.path.isfile(path):
+                source = os.path.realpath(path)
+            elif os.path.isdir(path) or glob.has_magic(path):
+                partitions = [os.path.realpath(file) for file in expand_inputs([path], PARTITION_FORMATS)
+                              if inside_root(file, SERVER_ROOT)]
+                if not partitions:
+                    st.error(f"No CSV, Arrow or Parquet files found under {SERVER_ROOT}: {server_path}")
+            else:
+                st.error(f"File not found on the server: {server_path}")
         
-        if uploaded_file is not None:
-            success, message = processor.load_csv(uploaded_file)
+        if source is not None or partitions:
+            if partitions:
+                success, message = processor.load_dataset(partitions)
+            elif follow and is_path(source):
+                success, message = processor.follow_csv(source)
+            else:
+                success, message = processor.load_csv(source, streaming=streaming)
             if success:
                 st.success(message)
                 
@@ -292,6 +3533,10 @@ def main():
             else:
                 st.error(message)
         
+        store = processor.dataset_cache.stats()
+        st.caption(f"Shared dataset store: {store['datasets']} datasets ({store['in_use']} in use by {store['sessions']} sessions), "
+                   f"{store['bytes'] / 1024 ** 2:.0f} of {store['max_bytes'] / 1024 ** 2:.0f} MB")
+        
         st.markdown("---")
         st.subheader("?? configuration management of Retrieval filtering ")
         
@@ -364,8 +3609,8 @@ def main():
                     with col4:
                         sort_order = st.selectbox(
                             "sort order",
-                            ["Ascending order, descending order"],
-                            index=0 if (i >= len(sorting_rules) or sorting_rules[i]['ascending'] else 1,
+                            ["Ascending order", "descending order"],
+                            index=0 if (i >= len(sorting_rules) or sorting_rules[i]['ascending']) else 1,
                             key=f"sort_order_{i}"
                         )
                     with col5:
@@ -391,12 +3636,25 @@ def main():
             
             filter_rules = processor.config.get('filters', [])
             new_filter_rules = []
+            op_mapping = {
+                "equal to": "eq",
+                "Not equal to": "ne",
+                "greater than": "gt",
+                "greater than or equal": "ge",
+                "less than": "lt",
+                "less than or equal": "le",
+                "contain": "contains",
+                "Regular matching": "regex",
+                "For empty": "isnull",
+                "Not empty": "notnull",
+                "in list": "in"
+            }
             
             for i, rule in enumerate(filter_rules):
                 col6, col7, col8, col9 = st.columns([2, 2, 3, 1])
                 with col6:
                     filter_col = st.selectbox(
-                        "",
+                        "领域",
                         all_columns,
                         index=all_columns.index(rule['column']),
                         key=f"filter_col_{i}"
@@ -404,12 +3662,12 @@ def main():
                 with col7:
                     filter_op = st.selectbox(
                         "Operation symbol",
-                        ["Equal to "," not equal to "," greater than "," greater than or equal to "," less than "," less than or equal to "," contains "," regular matching "," empty "," not empty "," in the list"],
-                        index=["eq", "ne", "gt", "ge", "lt", "le", "contains", "regex", "isnull", "notnull", "in"].index(rule['operator']),
+                        list(op_mapping),
+                        index=list(op_mapping.values()).index(rule['operator']),
                         key=f"filter_op_{i}"
                     )
                 with col8:
-                    if filter_op in ["Empty, not empty"]:
+                    if op_mapping[filter_op] in ["isnull", "notnull"]:
                         filter_value = ""
                     else:
                         filter_value = st.text_input(
@@ -422,20 +3680,6 @@ def main():
                     if st.button("?", key=f"remove_filter_{i}"):
                         continue
                 
-                op_mapping = {
-                    "equal to": "eq",
-                    "Not equal to": "ne",
-                    "greater than": "gt",
-                    "greater than or equal": "ge",
-                    "less than": "lt",
-                    "less than or equal": "le",
-                    "contain": "contains",
-                    "Regular matching": "regex",
-                    "For empty": "isnull",
-                    "Not empty": "notnull",
-                    "in list": "in"
-                }
-                
                 new_filter_rules.append({
                     "column": filter_col,
                     "operator": op_mapping[filter_op],
@@ -454,7 +3698,7 @@ def main():
             
             grouping_enabled = st.checkbox(
                 "Enable group aggregation", 
-                value=processor.config.get('grouping', {}).get('enabled', False)
+                value=(processor.config.get('grouping') or {}).get('enabled', False)
             )
             
             grouping_config = {"enabled": grouping_enabled}
@@ -467,7 +3711,7 @@ def main():
                     group_columns = st.multiselect(
                         "Grouped Fields",
                         all_columns,
-                        default=processor.config.get('grouping', {}).get('columns', [])
+                        default=(processor.config.get('grouping') or {}).get('columns', [])
                     )
                     grouping_config["columns"] = group_columns
                 
@@ -533,25 +3777,82 @@ def main():
             
             processor.update_config(new_config)
         
-        # Application Configuration Button
-        if st.button("?? Application configuration and data processing", use_container_width=True):
-            with st.spinner("Searching and processing data..."):
-                success, message = processor.process_data()
-                if success:
-                    st.success(message)
-                else:
-                    st.error(message)
+        # Instant preview on the reservoir sample, rerun with every rule change
+        if st.checkbox("Instant sample preview (estimates while editing rules)", value=False):
+            success, message = processor.preview_data()
+            if success:
+                st.info(message)
+                st.dataframe(processor.preview.head(), height=300)
+                st.caption("± is the half-width of the 95% confidence interval, min / max are the sample extremes")
+            else:
+                st.error(message)
+        
+        # Application Configuration Button: the exact query runs in the background, a new run replaces a running one
+        job = st.session_state.get('query_job')
+        if st.button("?? Application configuration and data processing (run exact)", use_container_width=True):
+            if job is not None and not job.done():
+                job.cancel()
+            if processor.df is not None:
+                job = processor.submit(get_query_executor())
+                st.session_state.query_job = job
+        
+        if job is not None and not job.done():
+            @st.fragment(run_every=1.0)
+            def show_progress():
+                if job.done():
+                    # Rerun the whole script to pick up the result
+                    st.rerun()
+                rows = f"{job.rows:,} rows" + (f" of {job.total_rows:,}" if job.total_rows else "")
+                st.progress(job.fraction, text=f"Searching and processing data... {job.stage}, {rows}, {job.elapsed():.0f}s")
+                if st.button("Cancel processing", disabled=job.cancel_event.is_set()):
+                    job.cancel()
+            show_progress()
+        elif job is not None and not job.collected:
+            success, message = processor.collect(job)
+            if success:
+                st.success(message)
+            else:
+                st.error(message)
         
         # Display configuration JSON
         st.subheader("?? currently allocated")
         st.json(processor.config)
+        with st.expander("Query plan"):
+            st.code(processor.explain())
         
         # results area
-        if processor.processed_df is not None:
+        if processor.result is not None:
             st.subheader("?? Processing results")
             
-            # Display result preview
-            st.dataframe(processor.processed_df.head(20), height=500)
+            # Display result preview, one page at a time
+            result = processor.result
+            pages = max(1, -(-len(result) // PREVIEW_ROWS))
+            page = int(st.number_input(f"Result page (of {pages})", min_value=1, max_value=pages, value=1))
+            st.dataframe(result.page(page - 1), height=500)
+            st.caption(f"Rows {min((page - 1) * PREVIEW_ROWS + 1, len(result))}-{min(page * PREVIEW_ROWS, len(result))} of {len(result)}")
+            if processor.memory_decision is not None:
+                st.info(f"Memory governor: {processor.memory_decision}")
+            
+            # Stage profile of the last run
+            profile = processor.last_profile
+            if profile is not None and profile.wall is not None:
+                with st.expander(f"Stage profile ({profile.wall * 1000:.1f} ms wall, {profile.cpu * 1000:.1f} ms CPU)"):
+                    st.dataframe(profile.to_frame(), hide_index=True)
+                    col17, col18 = st.columns(2)
+                    with col17:
+                        st.download_button(
+                            label="Download profile JSON",
+                            data=profile.to_json(),
+                            file_name="query_profile.json",
+                            mime="application/json"
+                        )
+                    with col18:
+                        st.download_button(
+                            label="Download Chrome trace",
+                            data=profile.chrome_trace(),
+                            file_name="query_trace.json",
+                            mime="application/json"
+                        )
             
             # export option
             st.subheader("?? Export Results")
@@ -560,36 +3861,171 @@ def main():
             
             with col15:
                 output_filename = st.text_input("output file name", "processed_data")
-                export_format = st.radio("export format", ["CSV", "JSON"])
+                formats = [name for name in EXPORT_FORMATS if name != "Parquet" or pa is not None]
+                export_format = st.radio("export format", formats)
+                compressions = [name for name in EXPORT_COMPRESSION if name != "zstd" or pa is not None]
+                compression = st.selectbox("compression", compressions)
             
             with col16:
                 st.write("")
                 st.write("")
-                if export_format == "CSV":
-                    csv_data = processor.export_to_csv()
-                    if csv_data:
-                        st.download_button(
-                            label="Download CSV file",
-                            data=csv_data,
-                            file_name=f"{output_filename}.csv",
-                            mime="text/csv"
-                        )
-                else:
-                    json_data = processor.export_to_json()
-                    if json_data:
-                        st.download_button(
-                            label="Download JSON file",
-                            data=json_data,
-                            file_name=f"{output_filename}.json",
-                            mime="application/json"
-                        )
+                # Serialized only when clicked, chunk by chunk into a file on disk that is read back for the download
+                st.download_button(
+                    label=f"Download {export_format} file",
+                    data=lambda: processor.export_bytes(export_format, compression),
+                    file_name=processor.export_file_name(output_filename, export_format, compression),
+                    mime=processor.export_mime(export_format, compression)
+                )
     else:
-        st.info("Please upload CSV file to start processing")
+        st.info("Please upload CSV file to start processing。")
     
     # footer of UI
     st.markdown("---")
     st.markdown('<div class="footer">CSV Data Retrieval and Conversion Tool(China Mobile | Built with Python and Streamlinet</div>', unsafe_allow_html=True)
 
+# Headless batch mode: apply a saved configuration to many CSV files
+def expand_inputs(inputs, extensions=(".csv",)):
+    #"""Files of a list of paths, glob patterns and directories, directories contribute files with these extensions"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(sorted(path for path in glob.glob(os.path.join(item, "*"))
+                                if os.path.splitext(path)[1].lower() in extensions))
+        elif glob.has_magic(item):
+            files.extend(sorted(glob.glob(item)))
+        else:
+            files.append(item)
+    return list(dict.fromkeys(files))
+
+def run_batch_file(task):
+    #"""Load, process and export one CSV file, returns its timing and row counts"""
+    started = time.perf_counter()
+    result = {"file": task['file'], "output": task['output'], "rows": 0, "columns": 0, "seconds": 0.0, "error": None}
+    try:
+        processor = CSVDataProcessor()
+        processor.chunk_size = task['chunk_size']
+        processor.optimize_dtypes = task['optimize_dtypes']
+        processor.log_profile = task['log_profile']
+        if task['log_profile']:
+            enable_profile_logging()
+        processor.parser_backend = task['parser']
+        processor.parse_threads = task['parse_threads']
+        processor.block_size = task['block_size']
+        processor.encoding = task['encoding']
+        processor.memory_budget = task['memory_budget']
+        processor.load_config_from_json(task['config'])
+        if task['partitions'] is not None:
+            success, message = processor.load_dataset(task['partitions'])
+        else:
+            # Read from the path: memory-mapped, no upload buffer copy
+            success, message = processor.load_csv(task['file'], streaming=task['streaming'])
+        if success:
+            success, message = processor.process_data()
+        if success:
+            write_export(processor.export_data, task['output'], task['format'], task['compression'])
+            result['rows'], result['columns'] = len(processor.result), len(processor.result.columns)
+        else:
+            result['error'] = message
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def batch_main(argv=None):
+    #"""Command line entry point: python csv_filter.py --config data_config.json --output-dir out data/*.csv"""
+    parser = argparse.ArgumentParser(description="Apply a saved retrieval configuration to CSV files")
+    parser.add_argument("inputs", nargs="+", help="CSV files, glob patterns or directories")
+    parser.add_argument("--config", required=True, help="configuration JSON exported from the UI")
+    parser.add_argument("--output-dir", required=True, help="directory of the processed files")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="CSV")
+    parser.add_argument("--compression", choices=list(EXPORT_COMPRESSION), default="none")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="files processed concurrently")
+    parser.add_argument("--streaming", action="store_true", help="process each file in chunks")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--optimize-dtypes", action="store_true", help="optimize column types at load")
+    parser.add_argument("--log-profile", action="store_true", help="log the stage profile of every file")
+    parser.add_argument("--parser", choices=["auto"] + list(PARSER_BACKENDS), default="auto", help="CSV parser backend")
+    parser.add_argument("--parse-threads", type=int, help="parser threads per file (default: cores / workers)")
+    parser.add_argument("--block-size", type=int, default=ARROW_BLOCK_SIZE >> 20, help="parser block size in MB")
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--memory-budget", type=int, default=QUERY_MEMORY_BUDGET >> 20,
+                        help="process memory budget in MB, queries estimated over it run in chunks (0 = unlimited)")
+    parser.add_argument("--dataset", metavar="NAME",
+                        help="query the inputs (CSV, Arrow and Parquet partitions) as one dataset, written to a single output NAME")
+    args = parser.parse_args(argv)
+    
+    with open(args.config, encoding='utf-8') as config_file:
+        config = config_file.read()
+    processor = CSVDataProcessor()
+    success, message = processor.load_config_from_json(config)
+    if not success:
+        print(message, file=sys.stderr)
+        return 2
+    
+    files = expand_inputs(args.inputs, PARTITION_FORMATS if args.dataset else (".csv",))
+    if not files:
+        print("No CSV files matched the inputs", file=sys.stderr)
+        return 2
+    # One dataset: its files are pruned and scanned by a single task
+    partitions = None
+    if args.dataset:
+        partitions, files = files, [args.dataset]
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Files already run in parallel, the cores are shared between their parsers
+    parse_threads = args.parse_threads or max(1, (os.cpu_count() or 1) // max(1, min(args.workers, len(files))))
+    tasks = []
+    for path in files:
+        name = os.path.splitext(os.path.basename(path))[0]
+        output = os.path.join(args.output_dir, processor.export_file_name(name, args.format, args.compression))
+        tasks.append({
+            "file": path,
+            "partitions": partitions,
+            "output": output,
+            "config": config,
+            "format": args.format,
+            "compression": args.compression,
+            "streaming": args.streaming,
+            "chunk_size": args.chunk_size,
+            "optimize_dtypes": args.optimize_dtypes,
+            "log_profile": args.log_profile,
+            "parser": args.parser,
+            "parse_threads": parse_threads,
+            "block_size": args.block_size << 20,
+            "encoding": args.encoding,
+            "memory_budget": args.memory_budget << 20
+        })
+    outputs = [task['output'] for task in tasks]
+    if len(set(outputs)) != len(outputs):
+        print("Input files with the same name would overwrite each other's output", file=sys.stderr)
+        return 2
+    
+    started = time.perf_counter()
+    results = []
+    workers = max(1, min(args.workers, len(tasks)))
+    if workers == 1:
+        completed = (run_batch_file(task) for task in tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        futures = [pool.submit(importable(run_batch_file), task) for task in tasks]
+        completed = (future.result() for future in as_completed(futures))
+    for result in completed:
+        results.append(result)
+        if result['error'] is None:
+            print(f"{result['file']}: {result['rows']} rows, {result['columns']} columns in {result['seconds']:.2f}s -> {result['output']}")
+        else:
+            print(f"{result['file']}: FAILED in {result['seconds']:.2f}s: {result['error']}", file=sys.stderr)
+    if workers > 1:
+        pool.shutdown()
+    
+    failed = sum(1 for result in results if result['error'] is not None)
+    total_rows = sum(result['rows'] for result in results)
+    print(f"{len(results) - failed} of {len(results)} files processed, {total_rows} rows in {time.perf_counter() - started:.2f}s")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
-    main()
+    # "streamlit run" starts the UI, plain "python" runs the batch command line
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(batch_main())
 	
\ No newline at end of file
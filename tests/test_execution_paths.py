@@ -0,0 +1,179 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+import benchmark
+import csv_filter
+from csv_filter import CSVDataProcessor, DatasetCache, ResultCache
+
+ROWS = 24000
+
+CONFIGS = {
+    "filter and select": {
+        "selected_columns": ["msisdn", "region", "fee", "roaming"],
+        "filters": [{"column": "fee", "operator": "gt", "value": 40}, {"column": "roaming", "operator": "eq", "value": "N"}],
+        "sorting": [],
+        "grouping": None,
+        "aggregations": []
+    },
+    "filter and sort": {
+        "selected_columns": [],
+        "filters": [{"column": "plan", "operator": "ne", "value": "prepaid_basic"}],
+        "sorting": [{"column": "region", "ascending": True}, {"column": "fee", "ascending": False}, {"column": "msisdn", "ascending": True}],
+        "grouping": None,
+        "aggregations": []
+    },
+    "group aggregation": {
+        "selected_columns": [],
+        "filters": [{"column": "duration_sec", "operator": "ge", "value": 60}],
+        "sorting": [],
+        "grouping": {"enabled": True, "columns": ["region", "roaming"]},
+        "aggregations": [{"column": "fee", "function": "sum"}, {"column": "data_mb", "function": "mean"},
+                         {"column": "duration_sec", "function": "max"}, {"column": "msisdn", "function": "count"}]
+    }
+}
+
+@pytest.fixture(scope="module")
+def telecom_csv(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("data") / "telecom.csv")
+    benchmark.generate_telecom_csv(path, ROWS, null_rate=0.02, regions=12, seed=5)
+    return path
+
+def run(processor, config):
+    processor.update_config(config)
+    success, message = processor.process_data()
+    assert success, message
+    return processor.processed_df.reset_index(drop=True)
+
+def in_memory(path, config):
+    processor = CSVDataProcessor()
+    assert processor.load_csv(path)[0]
+    return run(processor, config)
+
+def assert_same_result(result, expected):
+    # Chunks infer their dtypes on their own, int columns with missing values in some chunks only become float
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_exact=False, rtol=1e-9)
+
+@pytest.mark.parametrize("name", list(CONFIGS))
+def test_streaming_matches_in_memory(telecom_csv, name):
+    processor = CSVDataProcessor()
+    processor.chunk_size = 5000
+    assert processor.load_csv(telecom_csv, streaming=True)[0]
+    assert_same_result(run(processor, CONFIGS[name]), in_memory(telecom_csv, CONFIGS[name]))
+
+@pytest.mark.parametrize("name", list(CONFIGS))
+def test_partitioned_matches_in_memory(telecom_csv, tmp_path, name):
+    frame = pd.read_csv(telecom_csv, dtype=str, keep_default_na=False)
+    paths = []
+    for part, start in enumerate(range(0, ROWS, ROWS // 3)):
+        paths.append(str(tmp_path / f"part-{part}.csv"))
+        frame.iloc[start:start + ROWS // 3].to_csv(paths[-1], index=False)
+    processor = CSVDataProcessor()
+    assert processor.load_dataset(paths)[0]
+    assert_same_result(run(processor, CONFIGS[name]), in_memory(telecom_csv, CONFIGS[name]))
+
+@pytest.mark.parametrize("name", list(CONFIGS))
+def test_parallel_matches_in_memory(telecom_csv, monkeypatch, name):
+    monkeypatch.setattr(csv_filter, "PARALLEL_MIN_ROWS", 1000)
+    processor = CSVDataProcessor()
+    processor.workers = 2
+    assert processor.load_csv(telecom_csv)[0]
+    result = run(processor, CONFIGS[name])
+    assert processor.shared_path is not None
+    assert_same_result(result, in_memory(telecom_csv, CONFIGS[name]))
+    processor.release_shared_table()
+
+@pytest.mark.parametrize("name", list(CONFIGS))
+def test_governed_chunks_match_in_memory(telecom_csv, name):
+    processor = CSVDataProcessor()
+    assert processor.load_csv(telecom_csv)[0]
+    # No headroom at all: every query runs in chunks of the loaded frame
+    processor.memory_budget = 1
+    result = run(processor, CONFIGS[name])
+    assert processor.memory_decision.startswith("chunked")
+    assert_same_result(result, in_memory(telecom_csv, CONFIGS[name]))
+
+@pytest.mark.parametrize("name", list(CONFIGS))
+def test_follow_matches_in_memory(telecom_csv, tmp_path, name):
+    with open(telecom_csv, 'rb') as handle:
+        lines = handle.readlines()
+    path = str(tmp_path / "growing.csv")
+    half = len(lines) // 2
+    with open(path, 'wb') as out:
+        out.writelines(lines[:half])
+    processor = CSVDataProcessor()
+    assert processor.follow_csv(path)[0]
+    run(processor, CONFIGS[name])
+    with open(path, 'ab') as out:
+        out.writelines(lines[half:])
+    result = run(processor, CONFIGS[name])
+    assert processor.follow.rows == ROWS
+    assert_same_result(result, in_memory(telecom_csv, CONFIGS[name]))
+
+@pytest.mark.parametrize("error", [csv_filter.QueryCancelled, KeyError])
+def test_interrupted_streaming_sort_removes_its_runs(telecom_csv, tmp_path, monkeypatch, error):
+    monkeypatch.setattr(csv_filter.tempfile, "tempdir", str(tmp_path))
+    processor = CSVDataProcessor()
+    processor.chunk_size = 5000
+    assert processor.load_csv(telecom_csv, streaming=True)[0]
+    scanned = []
+    def progress(stage, rows=None, fraction=None):
+        if stage == "scan csv chunks":
+            scanned.append(rows)
+            if len(scanned) == 3:
+                raise error("stop")
+    processor.progress = progress
+    processor.update_config(CONFIGS["filter and sort"])
+    success, _ = processor.process_data()
+    assert not success and len(scanned) == 3
+    assert list(tmp_path.iterdir()) == []
+
+def test_result_cache_misses_after_the_file_changes(telecom_csv, tmp_path):
+    path = str(tmp_path / "data.csv")
+    shutil.copy(telecom_csv, path)
+    config = CONFIGS["group aggregation"]
+    processor = CSVDataProcessor()
+    processor.dataset_cache, processor.result_cache = DatasetCache(), ResultCache()
+    assert processor.load_csv(path)[0]
+    run(processor, config)
+    first_key = processor.result_key()
+
+    benchmark.generate_telecom_csv(path, ROWS // 2, regions=12, seed=6)
+    assert processor.load_csv(path)[0]
+    assert processor.result_key() != first_key
+    assert_same_result(run(processor, config), in_memory(path, config))
+
+def test_kept_filter_positions_are_dropped_with_the_loaded_frame(telecom_csv, tmp_path):
+    path = str(tmp_path / "data.csv")
+    shutil.copy(telecom_csv, path)
+    config = CONFIGS["filter and select"]
+    processor = CSVDataProcessor()
+    assert processor.load_csv(path)[0]
+    run(processor, config)
+    assert processor.filter_states and processor.selection_state is not None
+
+    benchmark.generate_telecom_csv(path, ROWS // 2, regions=12, seed=6)
+    assert processor.load_csv(path)[0]
+    assert_same_result(run(processor, config), in_memory(path, config))
+    assert len(processor.filter_states) == 1
+
+def test_dataset_store_shares_one_frame_per_file_content(telecom_csv, tmp_path):
+    store = DatasetCache()
+    processors = []
+    for _ in range(2):
+        processor = CSVDataProcessor()
+        processor.dataset_cache = store
+        assert processor.load_csv(telecom_csv)[0]
+        processors.append(processor)
+    assert store.stats()['datasets'] == 1
+    with pytest.raises(ValueError):
+        processors[1].df.iloc[0, processors[1].df.columns.get_loc("fee")] = 0.0
+
+    path = str(tmp_path / "other.csv")
+    benchmark.generate_telecom_csv(path, ROWS // 2, regions=12, seed=6)
+    processor = CSVDataProcessor()
+    processor.dataset_cache = store
+    assert processor.load_csv(path)[0]
+    assert store.stats()['datasets'] == 2
+    assert len(processor.df) == ROWS // 2
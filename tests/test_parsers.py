@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+import benchmark
+import csv_filter
+from csv_filter import CSVDataProcessor, PandasParser
+
+pytestmark = pytest.mark.skipif(csv_filter.pa is None, reason="the Arrow backend requires pyarrow")
+
+CASES = {
+    "identifiers beyond int64": "iccid,fee\n89860012345678901234,1.5\n89860012345678901235,2\n",
+    "unsigned beyond int64": "counter,fee\n18446744073709551615,1\n9223372036854775808,2\n",
+    "repeated headers": "a,a,b\n1,2,x\n3,4,y\n",
+    "column without values": "a,empty,b\n1,,x\n2,,y\n",
+    "dates, booleans and missing strings": "day,flag,name,value\n2024-01-02,true,,1\n2024-01-03,false,b,\n",
+}
+
+def load(path, backend):
+    processor = CSVDataProcessor()
+    processor.parser_backend = backend
+    success, message = processor.load_csv(path)
+    assert success, message
+    return processor.df
+
+@pytest.mark.parametrize("backend", ["pyarrow", "auto"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_arrow_backend_matches_pandas(tmp_path, case, backend):
+    path = tmp_path / "data.csv"
+    path.write_text(CASES[case])
+    pd.testing.assert_frame_equal(load(str(path), backend), PandasParser().read(str(path)))
+
+def test_arrow_backend_matches_pandas_on_generated_data(tmp_path):
+    path = str(tmp_path / "telecom.csv")
+    benchmark.generate_telecom_csv(path, 5000, null_rate=0.05, regions=10, seed=3)
+    pd.testing.assert_frame_equal(load(path, "pyarrow"), load(path, "pandas"))
+
+def test_equality_filter_keeps_distinct_identifiers(tmp_path):
+    path = tmp_path / "ids.csv"
+    path.write_text(CASES["identifiers beyond int64"])
+    processor = CSVDataProcessor()
+    processor.load_csv(str(path))
+    processor.config['filters'] = [{"column": "iccid", "operator": "eq", "value": "89860012345678901234"}]
+    success, message = processor.process_data()
+    assert success, message
+    assert len(processor.processed_df) == 1